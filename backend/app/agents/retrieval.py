@@ -3,16 +3,24 @@ Enhanced Document Retrieval Agent - RAG-based document search and retrieval
 Supports both JSON data and PDF documents with embedding-based similarity search
 """
 
+import asyncio
+import io
 import json
+import os
+from concurrent.futures import Executor
+from pathlib import Path
 from typing import Dict, Any, List, Optional
 from dataclasses import dataclass
-import hashlib
-from ..services.llm_service import LLMService
+import msgspec
+import numpy as np
+from ..core.config import EMBEDDINGS_DIR
+from ..services.llm_service import LLMService, get_llm_service
 from ..services.data_service import DataService
-from ..services.pdf_processing_service import pdf_processing_service, DocumentChunk
+from ..services.pdf_processing_service import get_document_processing_service, DocumentChunk
+from ..utils.hashing import fast_hexdigest
+from .scoring import BM25Index, DotKernel, QuantizedMatrix, TokenBitsets
 
-@dataclass
-class DocumentChunk:
+class DocumentChunk(msgspec.Struct, gc=False):
     id: str
     content: str
     source: str
@@ -21,15 +29,127 @@ class DocumentChunk:
     metadata: Dict[str, Any]
     relevance_score: float = 0.0
 
+# RAG prompt templates (static text is built once; only placeholders change per call)
+RAG_SYSTEM_PROMPT = """
+        You are Expert Company's AI assistant. Use the provided context to answer user queries accurately.
+        Always cite sources when providing information and indicate if information is not available in the context.
+        
+        Available Context:
+        {context}
+        
+        Response Guidelines:
+        - Use only information from the provided context
+        - Cite sources when making claims
+        - Indicate if the query cannot be fully answered with available information
+        - Respond in {language} language
+        - Maintain professional tone appropriate for petroleum/training industry
+        """
+
+RAG_USER_PROMPT = """
+        User query: "{query}"
+        
+        Provide a comprehensive response based on the available context.
+        """
+
+CONTEXT_CHUNK_TEMPLATE = """
+            Source: {source} ({category})
+            Content: {content}...
+            """
+CONTEXT_SEPARATOR = "\n---\n"
+
+# Corpora at least this large are scored through int8/1-bit codes instead of the float32 matrix
+QUANTIZATION_MIN_DOCS = int(os.getenv("RETRIEVAL_QUANTIZATION_MIN_DOCS", "20000"))
+QUANTIZATION_CANDIDATES = int(os.getenv("RETRIEVAL_QUANTIZATION_CANDIDATES", "1000"))
+
+# Score multipliers indexed by (category match << 1) | language match
+BOOST_FACTORS = np.array([1.0, 1.2, 1.3, 1.2 * 1.3], dtype=np.float32)
+
+# Corpora larger than this are narrowed by BM25 to this many candidates before embedding rerank
+BM25_CANDIDATES = int(os.getenv("RETRIEVAL_BM25_CANDIDATES", "100"))
+
+@dataclass(frozen=True)
+class CorpusIndex:
+    """
+    Immutable in-memory snapshot of the JSON corpus; replaced wholesale on reindex
+    """
+    chunks: List[DocumentChunk]
+    matrix: Optional[np.ndarray]  # L2-normalized (N, D) float32 rows, None without embeddings
+    language_names: List[str]  # distinct languages; language_codes index into this list
+    language_codes: np.ndarray
+    category_names: List[str]  # distinct categories; category_codes index into this list
+    category_codes: np.ndarray
+    kernel: Optional[DotKernel] = None  # scoring specialized to `matrix`
+    quantized: Optional[QuantizedMatrix] = None  # only built for large corpora
+    bm25: Optional[BM25Index] = None  # lexical pre-filter, only when the corpus exceeds BM25_CANDIDATES
+    token_bitsets: Optional[TokenBitsets] = None  # keyword scoring when there is no embedding matrix
+
+def _dedupe_documents(documents: List[DocumentChunk], seen: Optional[set] = None) -> List[DocumentChunk]:
+    """
+    Drop documents whose content was already seen, or JSON corpus entries whose (source, section)
+    pair was; first occurrence wins. Uploaded-file chunks are keyed by chunk id instead, since
+    a repeated heading does not make two chunks duplicates.
+    """
+    seen = set() if seen is None else seen
+    unique = []
+    for doc in documents:
+        keys = [fast_hexdigest(doc.content)]
+        if "source_type" in doc.metadata:
+            keys.append(("chunk", doc.id))
+        elif doc.metadata.get("section"):
+            keys.append((doc.source, doc.metadata["section"]))
+        if any(key in seen for key in keys):
+            continue
+        seen.update(keys)
+        unique.append(doc)
+    return unique
+
+def _top_k_indices(scores: np.ndarray, k: int) -> np.ndarray:
+    """
+    Indices of the k highest scores in descending order: O(N) partition plus O(k log k) sort
+    """
+    k = min(k, scores.size)
+    if k <= 0:
+        return np.empty(0, dtype=np.intp)
+    top = np.argpartition(-scores, k - 1)[:k]
+    return top[np.argsort(-scores[top], kind="stable")]
+
 class DocumentRetrievalAgent:
     """
     Specialized agent for document retrieval and RAG-based responses
     """
     
-    def __init__(self):
-        self.llm_service = LLMService()
+    def __init__(self, executor: Optional[Executor] = None):
         self.data_service = DataService()
+        # CPU-bound embedding and scoring run here (None = the loop's default executor)
+        self.executor = executor
         
+        # Built once by warm_up(); reindex() swaps in a new snapshot without locking
+        self._corpus: Optional[CorpusIndex] = None
+    
+    @property
+    def llm_service(self) -> LLMService:
+        """
+        Shared LLM service, created on first RAG response rather than at startup
+        """
+        return get_llm_service()
+    
+    async def warm_up(self) -> int:
+        """
+        Load, chunk and embed the JSON corpus once (called at application startup)
+        """
+        if self._corpus is None:
+            await self.reindex()
+        return len(self._corpus.chunks)
+    
+    async def reindex(self) -> int:
+        """
+        Rebuild the corpus snapshot and atomically swap it in; in-flight queries keep the old one
+        """
+        documents = await self._get_all_documents()
+        loop = asyncio.get_running_loop()
+        self._corpus = await loop.run_in_executor(self.executor, self._build_corpus_index, documents)
+        return len(documents)
+    
     async def retrieve_relevant_documents(
         self, 
         query: str, 
@@ -41,26 +161,35 @@ class DocumentRetrievalAgent:
         """
         Enhanced retrieval: Combines JSON data and PDF documents using embedding similarity
         """
-        all_docs = []
+        # JSON-based documents come from the in-memory corpus built at startup
+        if self._corpus is None:
+            await self.warm_up()
+        corpus = self._corpus
         
-        # Get JSON-based documents (existing functionality)
-        json_docs = await self._get_all_documents()
-        all_docs.extend(json_docs)
+        # Score all JSON documents at once against the precomputed embedding matrix (in the CPU pool);
+        # these come back already scored, thresholded and category-filtered
+        loop = asyncio.get_running_loop()
+        json_docs = await loop.run_in_executor(
+            self.executor, self._rank_corpus, query, corpus, language, max_results, category_filter
+        )
+        
+        pdf_docs: List[DocumentChunk] = []
         
         # Get PDF-based documents (new functionality)
         if include_pdfs:
             try:
-                pdf_docs = await pdf_processing_service.search_documents(
+                pdf_results = await get_document_processing_service().search_documents(
                     query=query,
                     language=language if language != "auto" else None,
                     category=category_filter,
                     max_results=max_results * 2,  # Get more PDF results for better mixing
-                    similarity_threshold=0.2
+                    similarity_threshold=0.2,
+                    executor=self.executor
                 )
                 
                 # Convert PDF DocumentChunks to our format for compatibility
-                for pdf_doc in pdf_docs:
-                    json_doc = DocumentChunk(
+                for pdf_doc in pdf_results:
+                    pdf_docs.append(DocumentChunk(
                         id=pdf_doc.id,
                         content=pdf_doc.content,
                         source=pdf_doc.source_file,
@@ -74,21 +203,17 @@ class DocumentRetrievalAgent:
                             "embedding_score": pdf_doc.relevance_score
                         },
                         relevance_score=pdf_doc.relevance_score
-                    )
-                    all_docs.append(json_doc)
+                    ))
                     
             except Exception as e:
                 # PDF search failed, continue with JSON only
                 pass
         
-        # For JSON documents, calculate relevance if not already done
-        for doc in all_docs:
-            if not hasattr(doc, 'relevance_score') or doc.relevance_score == 0.0:
-                doc.relevance_score = await self._calculate_relevance(query, doc, language)
-        
-        # Filter by relevance threshold and category
-        filtered_docs = []
-        for doc in all_docs:
+        # PDF documents carry their embedding score; drop ones duplicating a JSON result,
+        # then filter by relevance threshold and category
+        seen = set()
+        filtered_docs = _dedupe_documents(json_docs, seen)  # corpus is already unique; this records its keys
+        for doc in _dedupe_documents(pdf_docs, seen):
             if doc.relevance_score > 0.2:  # Lower threshold for mixed results
                 if category_filter:
                     if category_filter in doc.category or doc.category.endswith(category_filter):
@@ -96,9 +221,8 @@ class DocumentRetrievalAgent:
                 else:
                     filtered_docs.append(doc)
         
-        # Sort by relevance and return top results
-        filtered_docs.sort(key=lambda x: x.relevance_score, reverse=True)
-        return filtered_docs[:max_results]
+        # Select top results without sorting the whole candidate list
+        return self._top_k(filtered_docs, max_results)
     
     async def generate_rag_response(
         self, 
@@ -109,36 +233,15 @@ class DocumentRetrievalAgent:
         """
         Generate response using retrieved documents as context
         """
-        # Prepare context from retrieved documents
-        context_chunks = []
-        for doc in retrieved_docs:
-            context_chunks.append(f"""
-            Source: {doc.source} ({doc.category})
-            Content: {doc.content[:500]}...
-            """)
-        
-        context = "\n---\n".join(context_chunks)
-        
-        system_prompt = f"""
-        You are Expert Company's AI assistant. Use the provided context to answer user queries accurately.
-        Always cite sources when providing information and indicate if information is not available in the context.
-        
-        Available Context:
-        {context}
-        
-        Response Guidelines:
-        - Use only information from the provided context
-        - Cite sources when making claims
-        - Indicate if the query cannot be fully answered with available information
-        - Respond in {language} language
-        - Maintain professional tone appropriate for petroleum/training industry
-        """
+        # Prepare context from retrieved documents in a single buffer
+        buffer = io.StringIO()
+        for i, doc in enumerate(retrieved_docs):
+            if i:
+                buffer.write(CONTEXT_SEPARATOR)
+            buffer.write(CONTEXT_CHUNK_TEMPLATE.format(source=doc.source, category=doc.category, content=doc.content[:500]))
         
-        user_prompt = f"""
-        User query: "{query}"
-        
-        Provide a comprehensive response based on the available context.
-        """
+        system_prompt = RAG_SYSTEM_PROMPT.format_map({"context": buffer.getvalue(), "language": language})
+        user_prompt = RAG_USER_PROMPT.format_map({"query": query})
         
         try:
             response = await self.llm_service.generate_response(
@@ -165,29 +268,33 @@ class DocumentRetrievalAgent:
         """
         Get all available documents as chunks
         """
-        documents = []
+        # Independent loads run concurrently; failures are collected per source
+        petroleum_data, training_data, faq_data, ar_data, fr_data = await asyncio.gather(
+            self.data_service.get_petroleum_services(),
+            self.data_service.get_training_services(),
+            self.data_service.get_faq_data(),
+            self.data_service.get_services_data("ar"),
+            self.data_service.get_services_data("fr"),
+            return_exceptions=True
+        )
         
-        # Load petroleum services data
-        petroleum_data = await self.data_service.get_petroleum_services()
-        documents.extend(self._create_chunks_from_data(petroleum_data, "petroleum_services"))
-        
-        # Load training services data
-        training_data = await self.data_service.get_training_services()
-        documents.extend(self._create_chunks_from_data(training_data, "training_services"))
-        
-        # Load FAQ data
-        faq_data = await self.data_service.get_faq_data()
-        documents.extend(self._create_chunks_from_data(faq_data, "faq"))
+        documents = []
+        for data, category in (
+            (petroleum_data, "petroleum_services"),
+            (training_data, "training_services"),
+            (faq_data, "faq")
+        ):
+            if isinstance(data, BaseException):
+                raise data
+            documents.extend(self._create_chunks_from_data(data, category))
         
-        # Load multilingual data
-        for lang in ["ar", "fr"]:
-            try:
-                multilingual_data = await self.data_service.get_services_data(lang)
-                documents.extend(self._create_chunks_from_data(multilingual_data, f"services_{lang}"))
-            except:
-                continue
+        # Multilingual data is optional; skip languages that fail to load
+        for data, lang in ((ar_data, "ar"), (fr_data, "fr")):
+            if not isinstance(data, BaseException):
+                documents.extend(self._create_chunks_from_data(data, f"services_{lang}"))
         
-        return documents
+        # Duplicates would only be embedded and scored twice
+        return _dedupe_documents(documents)
     
     def _create_chunks_from_data(self, data: Dict, category: str) -> List[DocumentChunk]:
         """
@@ -198,7 +305,7 @@ class DocumentRetrievalAgent:
         
         if "content" in data:
             for key, value in data["content"].items():
-                chunk_id = hashlib.md5(f"{category}_{key}".encode()).hexdigest()[:8]
+                chunk_id = fast_hexdigest(f"{category}_{key}")[:8]
                 
                 # Create chunk content
                 content_parts = []
@@ -231,7 +338,196 @@ class DocumentRetrievalAgent:
         
         return chunks
     
-    async def _calculate_relevance(self, query: str, document: DocumentChunk, language: str) -> float:
+    def _build_corpus_index(self, documents: List[DocumentChunk]) -> CorpusIndex:
+        """
+        Embed document contents once into an L2-normalized (N, D) float32 matrix
+        """
+        matrix = None
+        if documents and get_document_processing_service().embedding_model is not None:
+            matrix = self._load_doc_matrix(documents)
+        
+        # Interned int codes let filters and boosts run as vectorized masks
+        language_names, language_codes = np.unique(
+            np.array([doc.language for doc in documents], dtype=object), return_inverse=True
+        )
+        category_names, category_codes = np.unique(
+            np.array([doc.category for doc in documents], dtype=object), return_inverse=True
+        )
+        
+        return CorpusIndex(
+            chunks=documents,
+            matrix=matrix,
+            language_names=language_names.tolist(),
+            language_codes=language_codes.astype(np.int16),
+            category_names=category_names.tolist(),
+            category_codes=category_codes.astype(np.int16),
+            kernel=DotKernel(matrix) if matrix is not None else None,
+            quantized=QuantizedMatrix.fit(matrix) if matrix is not None and len(documents) >= QUANTIZATION_MIN_DOCS else None,
+            token_bitsets=TokenBitsets.build([doc.content for doc in documents]) if matrix is None else None,
+            bm25=BM25Index.build([doc.content for doc in documents]) if matrix is not None and len(documents) > BM25_CANDIDATES else None
+        )
+    
+    @staticmethod
+    def _doc_matrix_path(model_id: str, corpus_key: str) -> Path:
+        """Cache file for one (embedding model, corpus) pair: doc_matrix-<model>-<corpus>.npy"""
+        return Path(EMBEDDINGS_DIR) / f"doc_matrix-{fast_hexdigest(model_id)}-{corpus_key}.npy"
+    
+    def _load_doc_matrix(self, documents: List[DocumentChunk]) -> np.ndarray:
+        """
+        Memory-map the document matrix from EMBEDDINGS_DIR, embedding and persisting it first
+        if this corpus has not been seen. The file name carries hashes of the embedding model
+        and of the corpus contents, so workers indexing the same corpus share one file through
+        the OS page cache and a model change never reuses another model's vectors.
+        """
+        service = get_document_processing_service()
+        corpus_key = fast_hexdigest("\x1f".join(doc.content for doc in documents))
+        path = self._doc_matrix_path(service.embedding_model_id, corpus_key)
+        
+        if not path.exists():
+            embeddings = service.embedding_model.encode(
+                [doc.content for doc in documents], batch_size=32, show_progress_bar=False
+            )
+            # The configured ONNX model may have fallen back to PyTorch while loading
+            path = self._doc_matrix_path(service.embedding_model_id, corpus_key)
+            matrix = np.ascontiguousarray(embeddings, dtype=np.float32)
+            norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+            matrix /= np.maximum(norms, 1e-12)
+            
+            # Write then rename so concurrent readers never map a partial file
+            tmp_path = path.with_name(f"{path.stem}.{os.getpid()}.tmp.npy")
+            np.save(tmp_path, matrix)
+            os.replace(tmp_path, path)
+            # Only this model's older matrices; other models may share the directory
+            model_prefix = path.name[:path.name.rindex("-") + 1]
+            for stale in path.parent.glob(f"{model_prefix}*.npy"):
+                if stale != path and ".tmp" not in stale.name:
+                    stale.unlink(missing_ok=True)
+        
+        if hasattr(os, "posix_fadvise"):
+            # Hint the kernel to read the matrix ahead of the first query
+            fd = os.open(path, os.O_RDONLY)
+            try:
+                os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_WILLNEED)
+            finally:
+                os.close(fd)
+        
+        return np.load(path, mmap_mode='r')
+    
+    def _rank_corpus(
+        self,
+        query: str,
+        corpus: CorpusIndex,
+        language: str,
+        max_results: int,
+        category_filter: Optional[str]
+    ) -> List[DocumentChunk]:
+        """
+        Score and select corpus documents (CPU-bound, runs in the executor).
+        Scores may live in a per-thread buffer, so they never leave this call.
+        """
+        scores = self._score_documents(query, corpus, language)
+        return self._select_scored_documents(corpus, scores, max_results, category_filter)
+    
+    def _score_documents(self, query: str, corpus: CorpusIndex, language: str) -> np.ndarray:
+        """
+        Score every corpus document with a single matrix-vector product (cosine over normalized rows).
+        Falls back to keyword relevance when no embeddings are available.
+        """
+        if corpus.matrix is None:
+            if corpus.token_bitsets is None:
+                return np.array(
+                    [self._calculate_relevance(query, doc, language) for doc in corpus.chunks],
+                    dtype=np.float32
+                )
+            # Keyword fallback: Jaccard over token bitsets
+            scores = corpus.token_bitsets.jaccard(query.lower().split())
+        
+        else:
+            query_vec = self._embed_query(query)
+            
+            # Two-pass retrieval: cheap BM25 narrows the corpus, embeddings rerank the candidates.
+            # Without lexical overlap, large corpora use the 1-bit Hamming pre-filter instead.
+            candidates = None
+            if corpus.bm25 is not None:
+                candidates = corpus.bm25.candidates(query.lower().split(), BM25_CANDIDATES)
+            if candidates is None and corpus.quantized is not None:
+                candidates = corpus.quantized.candidates(query_vec, QUANTIZATION_CANDIDATES)
+            
+            if candidates is None:
+                scores = corpus.kernel(query_vec)
+            else:
+                scores = corpus.kernel.buffer()
+                scores.fill(-np.inf)
+                if corpus.quantized is not None:
+                    scores[candidates] = corpus.quantized.dot(query_vec, candidates)
+                else:
+                    scores[candidates] = corpus.matrix[candidates] @ query_vec
+        
+        # Same language/category boosts as the keyword path, fused into one lookup:
+        # bit 0 = language match, bit 1 = boosted category match
+        boost_index = np.zeros(scores.shape, dtype=np.int8)
+        if language in corpus.language_names:
+            boost_index |= corpus.language_codes == corpus.language_names.index(language)
+        boosted_category = self._boosted_category(query.lower())
+        if boosted_category in corpus.category_names:
+            boost_index |= (corpus.category_codes == corpus.category_names.index(boosted_category)).view(np.int8) << 1
+        scores *= BOOST_FACTORS[boost_index]
+        
+        return scores
+    
+    def _embed_query(self, query: str) -> np.ndarray:
+        """
+        L2-normalized float32 query embedding
+        """
+        query_vec = np.asarray(get_document_processing_service().embedding_model.encode([query])[0], dtype=np.float32)
+        query_vec /= max(float(np.linalg.norm(query_vec)), 1e-12)
+        return query_vec
+    
+    def _select_scored_documents(
+        self,
+        corpus: CorpusIndex,
+        scores: np.ndarray,
+        max_results: int,
+        category_filter: Optional[str]
+    ) -> List[DocumentChunk]:
+        """
+        Keep the top-scoring documents above the relevance threshold as scored copies
+        """
+        mask = scores > 0.2
+        if category_filter:
+            mask &= self._category_mask(corpus, category_filter)
+        
+        candidates = np.flatnonzero(mask)
+        top = candidates[_top_k_indices(scores[candidates], max_results)]
+        
+        # Copies keep the cached corpus free of per-query scores
+        return [msgspec.structs.replace(corpus.chunks[i], relevance_score=float(scores[i])) for i in top]
+    
+    def _category_mask(self, corpus: CorpusIndex, category_filter: str) -> np.ndarray:
+        """
+        Boolean mask of documents whose category contains the filter, resolved once per distinct category
+        """
+        matching_codes = [code for code, name in enumerate(corpus.category_names) if category_filter in name]
+        return np.isin(corpus.category_codes, matching_codes)
+    
+    def _top_k(self, documents: List[DocumentChunk], k: int) -> List[DocumentChunk]:
+        """
+        Return the k most relevant documents, sorted by descending relevance
+        """
+        scores = np.fromiter((doc.relevance_score for doc in documents), dtype=np.float64, count=len(documents))
+        return [documents[i] for i in _top_k_indices(scores, k)]
+    
+    def _boosted_category(self, query_lower: str) -> Optional[str]:
+        """
+        Category whose documents get a relevance boost for this query, if any
+        """
+        if any(keyword in query_lower for keyword in ["drilling", "petroleum", "oil", "gas"]):
+            return "petroleum_services"
+        elif any(keyword in query_lower for keyword in ["training", "course", "certification"]):
+            return "training_services"
+        return None
+    
+    def _calculate_relevance(self, query: str, document: DocumentChunk, language: str) -> float:
         """
         Calculate relevance score between query and document
         """
@@ -252,13 +548,7 @@ class DocumentRetrievalAgent:
         language_boost = 1.2 if document.language == language else 1.0
         
         # Boost score for category relevance
-        category_boost = 1.0
-        if any(keyword in query_lower for keyword in ["drilling", "petroleum", "oil", "gas"]):
-            if document.category == "petroleum_services":
-                category_boost = 1.3
-        elif any(keyword in query_lower for keyword in ["training", "course", "certification"]):
-            if document.category == "training_services":
-                category_boost = 1.3
+        category_boost = 1.3 if document.category == self._boosted_category(query_lower) else 1.0
         
         return jaccard_score * language_boost * category_boost
     
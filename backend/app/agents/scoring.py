@@ -0,0 +1,207 @@
+"""
+Vectorized scoring kernels for the retrieval corpus
+Compressed embedding codes, a BM25 candidate pre-filter, and a bitset keyword (Jaccard)
+scorer for when embeddings are unavailable
+"""
+
+import threading
+from dataclasses import dataclass
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+# Numba is optional; without it the bitset kernel runs as NumPy array operations
+try:
+    import numba
+    NUMBA_AVAILABLE = True
+except ImportError:
+    NUMBA_AVAILABLE = False
+
+# Largest vocabulary encoded as per-document bitsets (1024 uint64 words per document)
+MAX_BITSET_VOCAB = 65536
+
+# Set bits per byte value, for popcounts over packed binary codes
+_POPCOUNT8 = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+
+if NUMBA_AVAILABLE:
+    @numba.njit(parallel=True, nogil=True, cache=True)
+    def _bitset_intersections(doc_bits, word_idx, query_words):
+        """Per-document popcount(doc & query) over the query's non-zero words (SWAR popcount)"""
+        counts = np.zeros(doc_bits.shape[0], dtype=np.int32)
+        m1 = np.uint64(0x5555555555555555)
+        m2 = np.uint64(0x3333333333333333)
+        m4 = np.uint64(0x0F0F0F0F0F0F0F0F)
+        h01 = np.uint64(0x0101010101010101)
+        for i in numba.prange(doc_bits.shape[0]):
+            total = 0
+            for j in range(word_idx.shape[0]):
+                x = doc_bits[i, word_idx[j]] & query_words[j]
+                x = x - ((x >> np.uint64(1)) & m1)
+                x = (x & m2) + ((x >> np.uint64(2)) & m2)
+                x = (x + (x >> np.uint64(4))) & m4
+                total += np.int32((x * h01) >> np.uint64(56))
+            counts[i] = total
+        return counts
+else:
+    def _bitset_intersections(doc_bits, word_idx, query_words):
+        """Per-document popcount(doc & query) over the query's non-zero words (byte lookup table)"""
+        shared = np.ascontiguousarray(doc_bits[:, word_idx] & query_words)
+        return _POPCOUNT8[shared.view(np.uint8)].sum(axis=1, dtype=np.int32)
+
+
+class DotKernel:
+    """
+    Matrix-vector scoring specialized to one corpus matrix: the matrix is made C-contiguous
+    float32 once, and each thread writes scores into its own preallocated output buffer
+    """
+    
+    def __init__(self, matrix: np.ndarray):
+        self.matrix = np.ascontiguousarray(matrix, dtype=np.float32)
+        self.rows, self.dim = self.matrix.shape
+        self._local = threading.local()
+    
+    def buffer(self) -> np.ndarray:
+        """This thread's (N,) float32 score buffer; overwritten by the next call on the same thread"""
+        out = getattr(self._local, "out", None)
+        if out is None:
+            out = self._local.out = np.empty(self.rows, dtype=np.float32)
+        return out
+    
+    def __call__(self, query_vec: np.ndarray) -> np.ndarray:
+        """Scores for a (D,) float32 query, written into this thread's buffer"""
+        return np.dot(self.matrix, query_vec, out=self.buffer())
+
+
+@dataclass(frozen=True)
+class QuantizedMatrix:
+    """
+    Compressed copy of the embedding matrix: per-column int8 codes (4x smaller than float32)
+    plus sign bits packed 8 per byte (32x smaller) for a Hamming pre-filter
+    """
+    codes: np.ndarray  # (N, D) int8
+    scale: np.ndarray  # (D,) float32
+    zero_point: np.ndarray  # (D,) float32, value represented by code -128
+    bits: np.ndarray  # (N, ceil(D / 8)) uint8
+    
+    @classmethod
+    def fit(cls, matrix: np.ndarray) -> "QuantizedMatrix":
+        """Fit per-column ranges on the 0.1/99.9 percentiles so outliers don't waste code space"""
+        low = np.quantile(matrix, 0.001, axis=0).astype(np.float32)
+        high = np.quantile(matrix, 0.999, axis=0).astype(np.float32)
+        scale = np.maximum(high - low, 1e-6) / 255.0
+        codes = np.clip(np.rint((matrix - low) / scale) - 128, -128, 127).astype(np.int8)
+        return cls(codes=codes, scale=scale, zero_point=low, bits=np.packbits(matrix > 0, axis=1))
+    
+    def candidates(self, query_vec: np.ndarray, limit: int) -> np.ndarray:
+        """Rows whose sign pattern is closest to the query's (smallest Hamming distance)"""
+        query_bits = np.packbits(query_vec > 0)
+        distances = _POPCOUNT8[np.bitwise_xor(self.bits, query_bits)].sum(axis=1, dtype=np.int32)
+        if distances.size <= limit:
+            return np.arange(distances.size)
+        return np.argpartition(distances, limit - 1)[:limit]
+    
+    def dot(self, query_vec: np.ndarray, rows: np.ndarray) -> np.ndarray:
+        """Approximate query . row for the given rows, dequantizing only those rows"""
+        weighted = query_vec * self.scale
+        offset = float(query_vec @ self.zero_point + 128.0 * weighted.sum())
+        return self.codes[rows].astype(np.float32) @ weighted + offset
+
+
+@dataclass(frozen=True)
+class TokenBitsets:
+    """
+    Each document's distinct lowercase tokens as a bitset over a fixed vocabulary,
+    so Jaccard similarity becomes popcount(query & doc) / (|query| + |doc| - overlap)
+    """
+    vocab: Dict[str, int]
+    bits: np.ndarray  # (N, ceil(V / 64)) uint64
+    token_counts: np.ndarray  # (N,) distinct tokens per document
+    
+    @classmethod
+    def build(cls, texts: List[str]) -> Optional["TokenBitsets"]:
+        """Encode the texts, or return None when the vocabulary is too large for bitsets"""
+        vocab: Dict[str, int] = {}
+        doc_tokens = []
+        for text in texts:
+            ids = {vocab.setdefault(token, len(vocab)) for token in text.lower().split()}
+            doc_tokens.append(np.fromiter(ids, dtype=np.int64, count=len(ids)))
+        
+        if len(vocab) > MAX_BITSET_VOCAB:
+            return None
+        
+        bits = np.zeros((len(texts), max(1, (len(vocab) + 63) // 64)), dtype=np.uint64)
+        for row, ids in enumerate(doc_tokens):
+            np.bitwise_or.at(bits[row], ids >> 6, np.left_shift(np.uint64(1), (ids & 63).astype(np.uint64)))
+        
+        token_counts = np.array([ids.size for ids in doc_tokens], dtype=np.int32)
+        return cls(vocab=vocab, bits=bits, token_counts=token_counts)
+    
+    def jaccard(self, query_tokens: Iterable[str]) -> np.ndarray:
+        """Jaccard similarity between the query's distinct tokens and every document"""
+        query_tokens = set(query_tokens)
+        if not query_tokens:
+            return np.zeros(self.bits.shape[0], dtype=np.float32)
+        
+        ids = np.array([self.vocab[t] for t in query_tokens if t in self.vocab], dtype=np.int64)
+        query_bits = np.zeros(self.bits.shape[1], dtype=np.uint64)
+        np.bitwise_or.at(query_bits, ids >> 6, np.left_shift(np.uint64(1), (ids & 63).astype(np.uint64)))
+        word_idx = np.flatnonzero(query_bits)
+        
+        overlap = _bitset_intersections(self.bits, word_idx, query_bits[word_idx])
+        union = len(query_tokens) + self.token_counts - overlap
+        return (overlap / np.maximum(union, 1)).astype(np.float32)
+
+
+@dataclass(frozen=True)
+class BM25Index:
+    """
+    Inverted index with precomputed Okapi BM25 weight per (term, document) posting,
+    so scoring a query is one scatter-add per query term
+    """
+    postings: Dict[str, Tuple[np.ndarray, np.ndarray]]  # term -> (doc rows int32, weights float32)
+    size: int
+    
+    @classmethod
+    def build(cls, texts: List[str], k1: float = 1.5, b: float = 0.75) -> "BM25Index":
+        """Index lowercase whitespace tokens of each text"""
+        term_docs: Dict[str, List[int]] = {}
+        term_freqs: Dict[str, List[int]] = {}
+        lengths = np.zeros(len(texts), dtype=np.float32)
+        for row, text in enumerate(texts):
+            tokens = text.lower().split()
+            lengths[row] = len(tokens)
+            counts: Dict[str, int] = {}
+            for token in tokens:
+                counts[token] = counts.get(token, 0) + 1
+            for token, count in counts.items():
+                term_docs.setdefault(token, []).append(row)
+                term_freqs.setdefault(token, []).append(count)
+        
+        avg_length = float(lengths.mean()) if len(texts) else 0.0
+        norm = k1 * (1 - b + b * lengths / max(avg_length, 1e-6))
+        postings = {}
+        for term, docs in term_docs.items():
+            rows = np.array(docs, dtype=np.int32)
+            tf = np.array(term_freqs[term], dtype=np.float32)
+            idf = np.log(1 + (len(texts) - rows.size + 0.5) / (rows.size + 0.5))
+            postings[term] = (rows, (idf * tf * (k1 + 1) / (tf + norm[rows])).astype(np.float32))
+        return cls(postings=postings, size=len(texts))
+    
+    def scores(self, query_tokens: Iterable[str]) -> np.ndarray:
+        """BM25 score of every document for the query's distinct tokens"""
+        scores = np.zeros(self.size, dtype=np.float32)
+        for token in set(query_tokens):
+            posting = self.postings.get(token)
+            if posting is not None:
+                scores[posting[0]] += posting[1]
+        return scores
+    
+    def candidates(self, query_tokens: Iterable[str], limit: int) -> Optional[np.ndarray]:
+        """Up to `limit` best-matching rows, or None when no document shares a term with the query"""
+        scores = self.scores(query_tokens)
+        rows = np.flatnonzero(scores > 0)
+        if rows.size == 0:
+            return None
+        if rows.size > limit:
+            rows = rows[np.argpartition(-scores[rows], limit - 1)[:limit]]
+        return rows
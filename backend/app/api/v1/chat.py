@@ -3,15 +3,19 @@ Simple RAG Chatbot API
 Supports document upload (JSON/Markdown/PDF) and intelligent chat with language detection
 """
 
-from fastapi import APIRouter, UploadFile, File, HTTPException, Query
+from fastapi import APIRouter, UploadFile, File, HTTPException, Query, Request
+from fastapi.responses import ORJSONResponse
 from typing import Optional, List, Dict, Any
 from pydantic import BaseModel, Field
 import asyncio
+import re
+import tempfile
 from datetime import datetime
 from pathlib import Path
 
-from ...services.pdf_processing_service import document_processing_service
+from ...services.pdf_processing_service import get_document_processing_service
 from ...agents.retrieval import DocumentRetrievalAgent
+from ...core.config import MAX_FILE_SIZE
 from ...utils.logging import logger
 
 router = APIRouter(tags=["🤖 RAG Chatbot"])
@@ -49,14 +53,20 @@ class DocumentInfo(BaseModel):
     chunks: int
     uploaded_at: str
 
-# Initialize retrieval agent
-retrieval_agent = DocumentRetrievalAgent()
-
 # Supported file types
 SUPPORTED_TYPES = {'.pdf', '.md', '.markdown', '.txt', '.json'}
 
+# Uploads are read in chunks and spooled to disk past 1MB
+UPLOAD_READ_SIZE = 64 * 1024
+UPLOAD_SPOOL_SIZE = 1024 * 1024
+
+# Language detection patterns
+ARABIC_CHAR_RE = re.compile(r'[\u0600-\u06FF]')
+WORD_RE = re.compile(r'[a-zà-ÿ]+')
+FRENCH_WORDS = frozenset({'le', 'la', 'les', 'un', 'une', 'des', 'et', 'avec', 'pour', 'dans', 'comment', 'que'})
+
 @router.post("/chat", response_model=ChatResponse, summary="💬 Chat with RAG")
-async def chat_with_rag(request: ChatRequest):
+async def chat_with_rag(request: ChatRequest, http_request: Request):
     """
     **Main RAG Chat Endpoint**
     
@@ -76,17 +86,26 @@ async def chat_with_rag(request: ChatRequest):
     start_time = datetime.now()
     
     try:
-        # Auto-detect language
-        language = await _detect_language(request.message)
+        # Embed the query and detect its language side by side in the CPU pool
+        # (query embeddings and search results are cached by the document service)
+        loop = asyncio.get_running_loop()
+        cpu_pool = getattr(http_request.app.state, "cpu_pool", None)
+        service = get_document_processing_service()
+        embed_task = None
+        if request.include_context:
+            embed_task = loop.run_in_executor(cpu_pool, service.encode_query, request.message)
+        language = await loop.run_in_executor(cpu_pool, _detect_language, request.message)
         logger.info(f"💬 Chat request: '{request.message[:50]}...' (language: {language})")
         
         # Get relevant context if requested
         context_chunks = []
-        if request.include_context:
-            context_chunks = await document_processing_service.search_documents(
+        if embed_task is not None:
+            context_chunks = await service.search_documents(
                 query=request.message,
                 language=language,
-                max_results=request.max_context
+                max_results=request.max_context,
+                query_embedding=await embed_task,
+                executor=cpu_pool
             )
         
         # Generate response based on context
@@ -156,17 +175,22 @@ async def upload_document(
                 detail=f"Unsupported file type. Supported: {', '.join(SUPPORTED_TYPES)}"
             )
         
-        # Check file size (10MB limit for simplicity)
-        file_content = await file.read()
-        if len(file_content) > 10 * 1024 * 1024:
-            raise HTTPException(status_code=413, detail="File too large (max 10MB)")
-        
-        logger.info(f"📤 Uploading: {file.filename} ({len(file_content)} bytes)")
-        
-        # Process document
-        result = await document_processing_service.upload_and_process_file(
-            file_content, file.filename, category, "auto"
-        )
+        with tempfile.SpooledTemporaryFile(max_size=UPLOAD_SPOOL_SIZE) as spool:
+            # Check file size incrementally (10MB limit) so oversized uploads are rejected early
+            total_bytes = 0
+            while chunk := await file.read(UPLOAD_READ_SIZE):
+                total_bytes += len(chunk)
+                if total_bytes > MAX_FILE_SIZE:
+                    raise HTTPException(status_code=413, detail="File too large (max 10MB)")
+                spool.write(chunk)
+            spool.seek(0)
+            
+            logger.info(f"📤 Uploading: {file.filename} ({total_bytes} bytes)")
+            
+            # Process document
+            result = await get_document_processing_service().upload_and_process_file(
+                spool, file.filename, category, "auto"
+            )
         
         if result.success:
             return UploadResponse(
@@ -194,18 +218,8 @@ async def list_documents():
     Get a list of all uploaded documents in the knowledge base.
     """
     try:
-        documents = []
-        for doc_id, doc_info in document_processing_service.document_index.get("documents", {}).items():
-            documents.append(DocumentInfo(
-                id=doc_id,
-                filename=doc_info["filename"],
-                file_type=doc_info["file_type"],
-                language=doc_info["language"],
-                chunks=doc_info["total_chunks"],
-                uploaded_at=doc_info["created_at"]
-            ))
-        
-        return documents
+        # Rows come straight from the service's columnar projection; skip per-row model validation
+        return ORJSONResponse(content=get_document_processing_service().list_documents())
         
     except Exception as e:
         logger.error(f"List documents failed: {str(e)}", exc_info=True)
@@ -219,18 +233,9 @@ async def delete_document(document_id: str):
     Remove a document from the knowledge base.
     """
     try:
-        if document_id not in document_processing_service.document_index.get("documents", {}):
+        if not get_document_processing_service().delete_document(document_id):
             raise HTTPException(status_code=404, detail="Document not found")
         
-        # Delete chunks file
-        chunks_file = document_processing_service.embeddings_dir / f"{document_id}_chunks.json"
-        if chunks_file.exists():
-            chunks_file.unlink()
-        
-        # Remove from index
-        del document_processing_service.document_index["documents"][document_id]
-        document_processing_service._save_document_index()
-        
         return {"success": True, "message": f"Document {document_id} deleted"}
         
     except HTTPException:
@@ -239,6 +244,24 @@ async def delete_document(document_id: str):
         logger.error(f"Delete failed: {str(e)}", exc_info=True)
         raise HTTPException(status_code=500, detail="Delete failed")
 
+@router.post("/admin/reindex", summary="🔄 Rebuild Retrieval Index")
+async def reindex_documents(request: Request):
+    """
+    **Rebuild Retrieval Index**
+    
+    Reload and re-embed the JSON knowledge base. The new index is swapped in
+    atomically; requests already in flight finish against the previous one.
+    """
+    try:
+        retrieval_agent: DocumentRetrievalAgent = request.app.state.retrieval_agent
+        total_chunks = await retrieval_agent.reindex()
+        logger.info(f"🔄 Retrieval index rebuilt ({total_chunks} chunks)")
+        return {"success": True, "chunks": total_chunks}
+        
+    except Exception as e:
+        logger.error(f"Reindex failed: {str(e)}", exc_info=True)
+        raise HTTPException(status_code=500, detail="Reindex failed")
+
 @router.get("/health", summary="💓 Health Check")
 async def health_check():
     """
@@ -261,16 +284,15 @@ async def health_check():
     }
 
 # Helper functions
-async def _detect_language(text: str) -> str:
+def _detect_language(text: str) -> str:
     """Auto-detect language from text"""
     text_sample = text[:500].lower()
     
     # Count Arabic characters
-    arabic_chars = sum(1 for char in text_sample if '\u0600' <= char <= '\u06FF')
+    arabic_chars = len(ARABIC_CHAR_RE.findall(text_sample))
     
-    # Common French words
-    french_words = ['le', 'la', 'les', 'un', 'une', 'des', 'et', 'avec', 'pour', 'dans', 'comment', 'que']
-    french_count = sum(1 for word in french_words if word in text_sample)
+    # Common French words (whole words only)
+    french_count = len(FRENCH_WORDS.intersection(WORD_RE.findall(text_sample)))
     
     if arabic_chars > 3:
         return "ar"
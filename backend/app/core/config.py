@@ -22,6 +22,10 @@ MAX_FILE_SIZE = 10 * 1024 * 1024  # 10MB
 UPLOAD_DIR = os.getenv("UPLOAD_DIR", "backend/data/uploads")
 EMBEDDINGS_DIR = os.getenv("EMBEDDINGS_DIR", "backend/data/embeddings")
 
+# Embed the retrieval corpus in the background at startup (loads the embedding model eagerly);
+# otherwise it is built on the first retrieval query or /admin/reindex
+RETRIEVAL_WARM_UP = os.getenv("RETRIEVAL_WARM_UP", "False").lower() == "true"
+
 # Language Configuration
 SUPPORTED_LANGUAGES = ["en", "ar", "fr"]
 DEFAULT_LANGUAGE = "en"
@@ -5,14 +5,21 @@ A clean, minimal AI assistant with document upload and intelligent responses
 
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.responses import ORJSONResponse
 from contextlib import asynccontextmanager
 import uvicorn
 import os
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 
 from .api.v1 import api_router
+from .core.config import RETRIEVAL_WARM_UP
+from .agents.retrieval import DocumentRetrievalAgent
+from .services.llm_service import close_llm_service
+from .services.pdf_processing_service import close_document_processing_service
 from .utils.logging import logger
+from .utils.request_cache import RequestCacheMiddleware
 
 # Application metadata
 APP_NAME = "RAG Chatbot API"
@@ -30,18 +37,40 @@ A clean, minimal AI assistant that can:
 Perfect for university projects and simple AI applications.
 """
 
+async def _warm_up_retrieval(retrieval_agent: DocumentRetrievalAgent):
+    """Background startup task: load and embed the retrieval corpus"""
+    try:
+        total_chunks = await retrieval_agent.warm_up()
+        logger.info(f"📚 Retrieval corpus loaded ({total_chunks} chunks)")
+    except Exception as e:
+        logger.warning(f"Retrieval corpus warm-up failed, will retry on first query: {e}")
+
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     """Application startup and shutdown events"""
     
     # Startup
     logger.info(f"🚀 Starting {APP_NAME} v{APP_VERSION}")
+    
+    # Dedicated pool for CPU-bound work (embedding, scoring) so the event loop stays responsive
+    app.state.cpu_pool = ThreadPoolExecutor(max_workers=os.cpu_count(), thread_name_prefix="cpu")
+    
+    # The retrieval corpus is embedded once, lazily on first use unless warm-up is enabled;
+    # warm-up runs after startup so the embedding model load doesn't delay serving
+    app.state.retrieval_agent = DocumentRetrievalAgent(executor=app.state.cpu_pool)
+    warm_up_task = asyncio.create_task(_warm_up_retrieval(app.state.retrieval_agent)) if RETRIEVAL_WARM_UP else None
+    
     logger.info("✅ RAG Chatbot ready for requests")
     
     yield
     
     # Shutdown
     logger.info("🛑 Shutting down RAG Chatbot")
+    if warm_up_task is not None:
+        warm_up_task.cancel()
+    app.state.cpu_pool.shutdown(wait=True)
+    await close_llm_service()
+    await close_document_processing_service()
 
 # Create FastAPI app
 app = FastAPI(
@@ -49,6 +78,7 @@ app = FastAPI(
     description=APP_DESCRIPTION,
     version=APP_VERSION,
     lifespan=lifespan,
+    default_response_class=ORJSONResponse,
     docs_url="/docs",
     redoc_url="/redoc",
     openapi_url="/openapi.json"
@@ -63,6 +93,9 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Per-request memoization scope (e.g. language detection reused within one chat turn)
+app.add_middleware(RequestCacheMiddleware)
+
 # Include API routes
 app.include_router(api_router, prefix="/api/v1")
 
@@ -108,7 +141,7 @@ async def global_health():
 @app.exception_handler(404)
 async def not_found_handler(request, exc):
     """Custom 404 handler"""
-    return JSONResponse(
+    return ORJSONResponse(
         status_code=404,
         content={
             "error": "Endpoint not found",
@@ -127,7 +160,7 @@ async def not_found_handler(request, exc):
 async def internal_error_handler(request, exc):
     """Custom 500 handler"""
     logger.error(f"Internal server error: {str(exc)}", exc_info=True)
-    return JSONResponse(
+    return ORJSONResponse(
         status_code=500,
         content={
             "error": "Internal server error",
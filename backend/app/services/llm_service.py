@@ -4,22 +4,200 @@ Simple LLM Service for RAG Chatbot - OpenAI integration
 
 import asyncio
 import time
-from typing import Dict, List, Optional, Any
-from openai import AsyncOpenAI
-import json
+from contextlib import nullcontext
+from typing import AsyncIterator, Dict, List, Optional, Any
+import httpx
+import orjson
+from cachetools import TTLCache
+from openai import APIConnectionError, AsyncOpenAI, InternalServerError, RateLimitError
+from tenacity import AsyncRetrying, retry_if_exception_type, stop_after_attempt, wait_exponential_jitter
+import logging
 import os
+import re
 
+# lingua is optional; it provides local language detection without an API call
+try:
+    from lingua import Language, LanguageDetectorBuilder
+    LINGUA_AVAILABLE = True
+except ImportError:
+    LINGUA_AVAILABLE = False
+
+# h2 is optional; without it the shared HTTP client falls back to HTTP/1.1
+try:
+    import h2
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
+
+# OpenTelemetry is optional; spans are only recorded when OTEL_ENABLED=1
+try:
+    from opentelemetry import trace
+    OTEL_AVAILABLE = True
+except ImportError:
+    OTEL_AVAILABLE = False
+
+# Redis is optional; only needed when LLM_CACHE_BACKEND=redis
+try:
+    import redis.asyncio as aioredis
+    REDIS_AVAILABLE = True
+except ImportError:
+    REDIS_AVAILABLE = False
+
+from ..utils.hashing import fast_hexdigest
 from ..utils.logging import get_logger
+from ..utils.request_cache import get_request_cache
 
 logger = get_logger(__name__)
 
 # Simple config
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY", "")
 OPENAI_MODEL = os.getenv("OPENAI_MODEL", "gpt-3.5-turbo")
-OPENAI_MAX_TOKENS = int(os.getenv("OPENAI_MAX_TOKENS", "1000"))
+# Smaller model for short, unstructured turns and language detection
+OPENAI_FAST_MODEL = os.getenv("OPENAI_FAST_MODEL", "gpt-4o-mini")
+FAST_MODEL_MAX_CHARS = 200
+OPENAI_MAX_TOKENS = int(os.getenv("OPENAI_MAX_TOKENS", "300"))
 OPENAI_TEMPERATURE = float(os.getenv("OPENAI_TEMPERATURE", "0.7"))
 SUPPORTED_LANGUAGES = ["en", "ar", "fr"]
 
+FALLBACK_RESPONSE = "I apologize, but I'm having trouble processing your request right now. Please try again later."
+
+# Batch API polling: starts at the base interval and backs off exponentially up to the cap
+LLM_BATCH_POLL_INTERVAL = float(os.getenv("LLM_BATCH_POLL_INTERVAL", "5"))
+LLM_BATCH_MAX_POLL_INTERVAL = float(os.getenv("LLM_BATCH_MAX_POLL_INTERVAL", "300"))
+BATCH_TERMINAL_STATUSES = frozenset({"completed", "failed", "expired", "cancelled"})
+
+# Connection pool for the shared OpenAI HTTP client
+OPENAI_MAX_CONNECTIONS = int(os.getenv("OPENAI_MAX_CONNECTIONS", "500"))
+OPENAI_MAX_KEEPALIVE = int(os.getenv("OPENAI_MAX_KEEPALIVE", "200"))
+
+# Transient API failures are retried; after this many consecutive failed calls the
+# circuit opens and calls fail fast for LLM_BREAKER_COOLDOWN seconds
+LLM_RETRY_ATTEMPTS = int(os.getenv("LLM_RETRY_ATTEMPTS", "4"))
+LLM_BREAKER_THRESHOLD = int(os.getenv("LLM_BREAKER_THRESHOLD", "5"))
+LLM_BREAKER_COOLDOWN = float(os.getenv("LLM_BREAKER_COOLDOWN", "30"))
+RETRYABLE_ERRORS = (RateLimitError, APIConnectionError, InternalServerError)
+
+# Upper bound on concurrent API requests issued by generate_many
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "20"))
+
+# Language detection: "local" (lingua, else heuristics) or "openai" (one LLM call per text)
+LANGUAGE_DETECTOR = os.getenv("LANGUAGE_DETECTOR", "local")
+
+# Completion cache: "memory" (per process) or "redis" (shared across workers)
+LLM_CACHE_BACKEND = os.getenv("LLM_CACHE_BACKEND", "memory")
+LLM_CACHE_SIZE = int(os.getenv("LLM_CACHE_SIZE", "1024"))
+LLM_CACHE_TTL = int(os.getenv("LLM_CACHE_TTL", "3600"))
+REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379/0")
+
+
+# Default system prompts by language, pre-built as message tuples; a byte-identical prefix
+# also keeps OpenAI's prompt caching effective. Short answers are also faster answers.
+_DEFAULT_SYSTEM_MESSAGES = {
+    language: ({"role": "system", "content": prompt},)
+    for language, prompt in {
+        "en": "You are a helpful AI assistant. Respond clearly and professionally. "
+              "Respond in under 100 words unless the user explicitly asks for detail.",
+        "ar": "أنت مساعد ذكي مفيد. استجب بوضوح وباحترافية. "
+              "أجب في أقل من 100 كلمة ما لم يطلب المستخدم التفاصيل صراحةً.",
+        "fr": "Vous êtes un assistant IA utile. Répondez clairement et professionnellement. "
+              "Répondez en moins de 100 mots sauf si l'utilisateur demande explicitement des détails."
+    }.items()
+}
+
+_tracer = trace.get_tracer(__name__) if OTEL_AVAILABLE and os.getenv("OTEL_ENABLED") == "1" else None
+
+# Trivial inputs answered locally without an API call, keyed on the normalized message
+_GREETING_REPLY = {
+    "en": "Hello! How can I help you today?",
+    "ar": "مرحباً! كيف يمكنني مساعدتك اليوم؟",
+    "fr": "Bonjour ! Comment puis-je vous aider aujourd'hui ?"
+}
+_THANKS_REPLY = {
+    "en": "You're welcome! Let me know if there's anything else I can help with.",
+    "ar": "على الرحب والسعة! أخبرني إذا كان هناك أي شيء آخر يمكنني مساعدتك به.",
+    "fr": "Je vous en prie ! N'hésitez pas si je peux vous aider avec autre chose."
+}
+_EMPTY_MESSAGE_REPLY = {
+    "en": "Could you tell me a bit more about what you need?",
+    "ar": "هل يمكنك إخباري بالمزيد عما تحتاجه؟",
+    "fr": "Pourriez-vous m'en dire un peu plus sur ce dont vous avez besoin ?"
+}
+_CANNED_REPLIES = {
+    **dict.fromkeys(("hi", "hello", "hey", "مرحبا", "السلام عليكم", "bonjour", "salut"), _GREETING_REPLY),
+    **dict.fromkeys(("thanks", "thank you", "شكرا", "merci", "merci beaucoup"), _THANKS_REPLY),
+}
+
+# UUIDs and ISO timestamps in a system prompt change its bytes on every call and defeat prompt caching
+_DYNAMIC_PROMPT_RE = re.compile(
+    r'[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}|\d{4}-\d{2}-\d{2}T\d{2}:\d{2}',
+    re.IGNORECASE
+)
+_STRUCTURED_RE = re.compile(r'json|```|[{}\[\]<>]', re.IGNORECASE)
+
+# Heuristic detection: Arabic characters by regex; French stop words by one tokenizing pass
+# and a set intersection (whole words only, so "le" never matches inside "hello")
+_ARABIC_RE = re.compile(r'[\u0600-\u06FF]')
+_WORD_RE = re.compile(r'[a-zà-ÿ]+')
+_FRENCH_SET = frozenset({'le', 'la', 'les', 'un', 'une', 'des', 'et', 'avec', 'pour'})
+
+# Restricting lingua to the supported languages keeps it small and fast
+if LINGUA_AVAILABLE:
+    _LINGUA_CODES = {Language.ENGLISH: "en", Language.ARABIC: "ar", Language.FRENCH: "fr"}
+_language_detector = None
+
+
+def _get_language_detector():
+    """Return the lingua detector (None without lingua), building it on first call."""
+    global _language_detector
+    if _language_detector is None and LINGUA_AVAILABLE:
+        _language_detector = LanguageDetectorBuilder.from_languages(*_LINGUA_CODES).build()
+    return _language_detector
+
+
+# One pooled HTTP client shared by every LLMService, so warm (TLS-established) connections are reused
+_http_client: Optional[httpx.AsyncClient] = None
+
+
+def _get_http_client() -> httpx.AsyncClient:
+    global _http_client
+    if _http_client is None or _http_client.is_closed:
+        _http_client = httpx.AsyncClient(
+            limits=httpx.Limits(max_connections=OPENAI_MAX_CONNECTIONS, max_keepalive_connections=OPENAI_MAX_KEEPALIVE),
+            http2=HTTP2_AVAILABLE,
+            timeout=httpx.Timeout(60.0, connect=5.0)
+        )
+    return _http_client
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling the API while the circuit breaker is open."""
+
+
+class _InflightAbandoned(Exception):
+    """Set on a shared in-flight completion whose owning request was cancelled."""
+
+
+class _CircuitBreaker:
+    """Counts consecutive failed calls; once over the threshold, rejects calls until the cooldown ends."""
+    
+    def __init__(self, threshold: int, cooldown: float):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.failures = 0
+        self.open_until = 0.0
+    
+    def check(self) -> None:
+        if self.failures >= self.threshold and time.monotonic() < self.open_until:
+            raise CircuitOpenError("LLM API circuit open after repeated failures")
+    
+    def record_success(self) -> None:
+        self.failures = 0
+    
+    def record_failure(self) -> None:
+        self.failures += 1
+        if self.failures >= self.threshold:
+            self.open_until = time.monotonic() + self.cooldown
+
 
 class LLMService:
     """Service for handling LLM interactions with OpenAI."""
@@ -29,13 +207,34 @@ class LLMService:
             logger.warning("OpenAI API key not provided - LLM features will be limited")
             self.client = None
         else:
-            self.client = AsyncOpenAI(api_key=OPENAI_API_KEY)
+            self.client = AsyncOpenAI(api_key=OPENAI_API_KEY, http_client=_get_http_client())
         
         self.model = OPENAI_MODEL
+        self.fast_model = OPENAI_FAST_MODEL
         self.max_tokens = OPENAI_MAX_TOKENS
         self.temperature = OPENAI_TEMPERATURE
         
-        logger.info(f"🤖 LLM Service initialized with model: {self.model}")
+        # Completion cache; concurrent identical misses share one in-flight request
+        self._cache = TTLCache(maxsize=LLM_CACHE_SIZE, ttl=LLM_CACHE_TTL)
+        self._inflight: Dict[str, asyncio.Future] = {}
+        self._dynamic_prompt_warned = False
+        self._breaker = _CircuitBreaker(LLM_BREAKER_THRESHOLD, LLM_BREAKER_COOLDOWN)
+        
+        self._redis = None
+        if LLM_CACHE_BACKEND == "redis":
+            if REDIS_AVAILABLE:
+                self._redis = aioredis.from_url(REDIS_URL)
+            else:
+                logger.warning("LLM_CACHE_BACKEND=redis but redis is not installed - using in-memory cache")
+        
+        logger.info("🤖 LLM Service initialized with model: %s", self.model)
+    
+    async def aclose(self) -> None:
+        """Close the shared HTTP connection pool (and redis connection); call once on shutdown."""
+        if self.client:
+            await self.client.close()
+        if self._redis is not None:
+            await self._redis.close()
     
     async def test_connection(self) -> Dict[str, Any]:
         """Test the OpenAI API connection."""
@@ -48,7 +247,7 @@ class LLMService:
         
         try:
             logger.info("Testing OpenAI API connection...")
-            start_time = time.time()
+            start_time = time.perf_counter()
             
             response = await self.client.chat.completions.create(
                 model=self.model,
@@ -60,7 +259,7 @@ class LLMService:
                 temperature=0.1
             )
             
-            duration = time.time() - start_time
+            duration = time.perf_counter() - start_time
             response_text = response.choices[0].message.content
             
             result = {
@@ -71,81 +270,387 @@ class LLMService:
                 "duration_seconds": round(duration, 2)
             }
             
-            logger.info(f"✅ OpenAI API test successful - {result['duration_seconds']}s")
+            logger.info("✅ OpenAI API test successful - %ss", result['duration_seconds'])
             return result
             
         except Exception as e:
-            logger.error(f"❌ OpenAI API test failed: {str(e)}")
+            logger.error("❌ OpenAI API test failed: %s", e)
             return {
                 "status": "error",
                 "error": str(e),
                 "model": self.model
             }
     
+    async def _create_completion(self, **params):
+        """chat.completions.create with jittered exponential backoff on transient errors, behind the circuit breaker."""
+        self._breaker.check()
+        span_context = _tracer.start_as_current_span("openai.chat.completions") if _tracer else nullcontext()
+        with span_context as span:
+            if span is not None:
+                span.set_attribute("model", params["model"])
+            try:
+                async for attempt in AsyncRetrying(
+                    retry=retry_if_exception_type(RETRYABLE_ERRORS),
+                    wait=wait_exponential_jitter(initial=0.5, max=8),
+                    stop=stop_after_attempt(LLM_RETRY_ATTEMPTS),
+                    reraise=True
+                ):
+                    with attempt:
+                        response = await self.client.chat.completions.create(**params)
+            except RETRYABLE_ERRORS:
+                self._breaker.record_failure()
+                raise
+            self._breaker.record_success()
+            usage = getattr(response, "usage", None)  # streams carry no usage
+            if span is not None and usage is not None:
+                span.set_attribute("tokens", usage.total_tokens)
+        return response
+    
+    def _pick_model(self, message: str, system_prompt: str = "") -> str:
+        """Fast model for short, unstructured requests; the main model otherwise.
+        
+        The system prompt counts toward the size, so RAG turns carrying retrieved context
+        stay on the main model.
+        """
+        if (
+            self.fast_model
+            and len(message) + len(system_prompt) < FAST_MODEL_MAX_CHARS
+            and not _STRUCTURED_RE.search(message)
+            and not _STRUCTURED_RE.search(system_prompt)
+        ):
+            return self.fast_model
+        return self.model
+    
+    def _cache_key(self, model: str, messages: List[Dict[str, str]], max_tokens: int, temperature: float) -> str:
+        """Stable digest of everything that determines a completion."""
+        payload = orjson.dumps((model, messages, max_tokens, temperature), option=orjson.OPT_SORT_KEYS)
+        return "llm:" + fast_hexdigest(payload)
+    
+    async def _cache_get(self, key: str) -> Optional[str]:
+        if self._redis is not None:
+            cached = await self._redis.get(key)
+            return cached.decode() if cached is not None else None
+        return self._cache.get(key)
+    
+    async def _cache_set(self, key: str, text: str) -> None:
+        if self._redis is not None:
+            await self._redis.set(key, text, ex=LLM_CACHE_TTL)
+        else:
+            self._cache[key] = text
+    
+    async def _cached_completion(
+        self,
+        messages: List[Dict[str, str]],
+        max_tokens: int,
+        temperature: float,
+        model: Optional[str] = None
+    ) -> str:
+        """Chat completion text, served from cache when the same request was made recently."""
+        model = model or self.model
+        key = self._cache_key(model, messages, max_tokens, temperature)
+        
+        while True:
+            cached = await self._cache_get(key)
+            if cached is not None:
+                logger.debug("✅ Response served from cache")
+                return cached
+            # No await between this check and the insert below, so the event loop makes it atomic
+            inflight = self._inflight.get(key)
+            if inflight is None:
+                break
+            try:
+                return await asyncio.shield(inflight)
+            except _InflightAbandoned:
+                continue  # the owning request was cancelled; retry (one waiter becomes the new owner)
+        
+        inflight = self._inflight[key] = asyncio.get_running_loop().create_future()
+        try:
+            response = await self._create_completion(
+                model=model,
+                messages=messages,
+                max_tokens=max_tokens,
+                temperature=temperature
+            )
+            response_text = response.choices[0].message.content
+            
+            # Release waiters before the (possibly remote) cache write
+            self._release_inflight(key, inflight)
+            inflight.set_result(response_text)
+            await self._cache_set(key, response_text)
+            return response_text
+        except asyncio.CancelledError:
+            # Don't propagate this request's cancellation into unrelated waiters
+            if not inflight.done():
+                inflight.set_exception(_InflightAbandoned())
+                inflight.exception()
+            raise
+        except Exception as e:
+            if inflight.done():
+                raise  # result already delivered; only the cache write failed
+            inflight.set_exception(e)
+            # Mark retrieved so waiter-less failures don't log "exception was never retrieved"
+            inflight.exception()
+            raise
+        finally:
+            self._release_inflight(key, inflight)
+    
+    def _release_inflight(self, key: str, inflight: asyncio.Future):
+        """Drop the in-flight entry for key, unless a later caller has already replaced it"""
+        if self._inflight.get(key) is inflight:
+            del self._inflight[key]
+    
     async def generate_response(
         self,
         message: str,
         system_prompt: str = "",
         language: str = "en",
-        temperature: Optional[float] = None
+        temperature: Optional[float] = None,
+        max_tokens: Optional[int] = None,
+        model: Optional[str] = None
     ) -> str:
-        """Generate a simple response using OpenAI."""
+        """Generate a simple response using OpenAI (model defaults to routing by request size)."""
         if not self.client:
             # Return a mock response if no OpenAI key
             return f"I understand your message: '{message}'. (Note: OpenAI not configured, this is a mock response)"
         
+        canned = self._canned_reply(message, language, system_prompt)
+        if canned is not None:
+            return canned
+        
         try:
-            messages = []
+            messages = self._build_messages(message, system_prompt, language)
             
-            # Add system prompt if provided
-            if system_prompt:
-                messages.append({"role": "system", "content": system_prompt})
-            else:
-                # Default system prompt based on language
-                default_prompts = {
-                    "en": "You are a helpful AI assistant. Respond clearly and professionally.",
-                    "ar": "أنت مساعد ذكي مفيد. استجب بوضوح وباحترافية.",
-                    "fr": "Vous êtes un assistant IA utile. Répondez clairement et professionnellement."
-                }
-                messages.append({"role": "system", "content": default_prompts.get(language, default_prompts["en"])})
-            
-            # Add user message
-            messages.append({"role": "user", "content": message})
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug("🤖 Generating response for: %r (language: %s)", message[:50], language)
             
-            logger.info(f"🤖 Generating response for: '{message[:50]}...' (language: {language})")
-            start_time = time.time()
-            
-            response = await self.client.chat.completions.create(
-                model=self.model,
-                messages=messages,
-                max_tokens=self.max_tokens,
-                temperature=temperature or self.temperature
+            return await self._cached_completion(
+                messages,
+                max_tokens=self.max_tokens if max_tokens is None else max_tokens,
+                temperature=self.temperature if temperature is None else temperature,
+                model=model or self._pick_model(message, system_prompt)
             )
-            
-            duration = time.time() - start_time
-            response_text = response.choices[0].message.content
-            tokens_used = response.usage.total_tokens
-            
-            logger.info(f"✅ Response generated ({tokens_used} tokens, {duration:.2f}s)")
-            return response_text
                 
         except Exception as e:
-            logger.error(f"❌ Failed to generate response: {str(e)}")
+            logger.error("❌ Failed to generate response: %s", e)
             # Return fallback response
-            return f"I apologize, but I'm having trouble processing your request right now. Please try again later."
+            return FALLBACK_RESPONSE
     
-    async def detect_language(self, text: str) -> str:
-        """Simple language detection (fallback to pattern matching if no OpenAI)."""
+    async def generate_response_stream(
+        self,
+        message: str,
+        system_prompt: str = "",
+        language: str = "en",
+        temperature: Optional[float] = None,
+        max_tokens: Optional[int] = None,
+        model: Optional[str] = None
+    ) -> AsyncIterator[str]:
+        """Stream a response as text deltas, so callers can forward tokens as they arrive."""
         if not self.client:
+            yield f"I understand your message: '{message}'. (Note: OpenAI not configured, this is a mock response)"
+            return
+        
+        canned = self._canned_reply(message, language, system_prompt)
+        if canned is not None:
+            yield canned
+            return
+        
+        messages = self._build_messages(message, system_prompt, language)
+        temperature = self.temperature if temperature is None else temperature
+        max_tokens = self.max_tokens if max_tokens is None else max_tokens
+        model = model or self._pick_model(message, system_prompt)
+        key = self._cache_key(model, messages, max_tokens, temperature)
+        
+        cached = await self._cache_get(key)
+        if cached is not None:
+            yield cached
+            return
+        
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("🤖 Streaming response for: %r (language: %s)", message[:50], language)
+        parts = []
+        try:
+            stream = await self._create_completion(
+                model=model,
+                messages=messages,
+                max_tokens=max_tokens,
+                temperature=temperature,
+                stream=True
+            )
+            async for chunk in stream:
+                if not chunk.choices:
+                    continue
+                delta = chunk.choices[0].delta.content or ""
+                if delta:
+                    parts.append(delta)
+                    yield delta
+        except Exception as e:
+            logger.error("❌ Failed to stream response: %s", e)
+            if not parts:
+                yield FALLBACK_RESPONSE
+            return
+        
+        # Only complete responses are cached
+        await self._cache_set(key, "".join(parts))
+    
+    async def generate_many(
+        self,
+        messages: List[str],
+        *,
+        system_prompt: str = "",
+        language: str = "en",
+        max_concurrency: int = LLM_MAX_CONCURRENCY,
+        priority: str = "interactive"
+    ) -> List[str]:
+        """
+        Generate responses for many messages concurrently, in input order.
+        max_concurrency bounds in-flight requests; keep it within the account's
+        requests-per-minute tier or the extra calls only come back as 429s.
+        priority="batch" submits through the Batch API instead (cheaper, completes within 24h).
+        """
+        if priority == "batch":
+            return await self.generate_batch(messages, system_prompt=system_prompt, language=language)
+        
+        semaphore = asyncio.Semaphore(max_concurrency)
+        
+        async def _one(message: str) -> str:
+            async with semaphore:
+                return await self.generate_response(message, system_prompt, language)
+        
+        return await asyncio.gather(*(_one(message) for message in messages))
+    
+    async def generate_batch(
+        self,
+        prompts: List[str],
+        *,
+        system_prompt: str = "",
+        language: str = "en"
+    ) -> List[str]:
+        """
+        Generate responses for non-interactive workloads through the OpenAI Batch API:
+        upload a JSONL of requests, poll until the batch finishes, then parse the output file.
+        Results are in input order; requests that failed inside the batch get the fallback response.
+        """
+        if not self.client:
+            return [
+                f"I understand your message: '{prompt}'. (Note: OpenAI not configured, this is a mock response)"
+                for prompt in prompts
+            ]
+        
+        lines = [
+            orjson.dumps({
+                "custom_id": str(i),
+                "method": "POST",
+                "url": "/v1/chat/completions",
+                "body": {
+                    "model": self.model,
+                    "messages": self._build_messages(prompt, system_prompt, language),
+                    "max_tokens": self.max_tokens,
+                    "temperature": self.temperature
+                }
+            })
+            for i, prompt in enumerate(prompts)
+        ]
+        batch_file = await self.client.files.create(
+            file=("batch.jsonl", b"\n".join(lines)),
+            purpose="batch"
+        )
+        batch = await self.client.batches.create(
+            input_file_id=batch_file.id,
+            endpoint="/v1/chat/completions",
+            completion_window="24h"
+        )
+        logger.info("📦 Submitted batch %s with %d requests", batch.id, len(prompts))
+        
+        delay = LLM_BATCH_POLL_INTERVAL
+        while batch.status not in BATCH_TERMINAL_STATUSES:
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, LLM_BATCH_MAX_POLL_INTERVAL)
+            batch = await self.client.batches.retrieve(batch.id)
+        
+        if batch.status != "completed" or not (batch.output_file_id or batch.error_file_id):
+            raise RuntimeError(f"Batch {batch.id} ended with status {batch.status}")
+        
+        # Successful requests are in the output file, failed ones in the error file
+        results: List[Optional[str]] = [None] * len(prompts)
+        for file_id in (batch.output_file_id, batch.error_file_id):
+            if not file_id:
+                continue
+            content = await self.client.files.content(file_id)
+            for line in content.content.splitlines():
+                if not line:
+                    continue
+                record = orjson.loads(line)
+                response = record.get("response") or {}
+                if response.get("status_code") == 200:
+                    results[int(record["custom_id"])] = response["body"]["choices"][0]["message"]["content"]
+                else:
+                    error = record.get("error") or (response.get("body") or {}).get("error")
+                    logger.warning("Batch request %s failed: %s", record.get("custom_id"), error)
+        
+        failed = results.count(None)
+        if failed:
+            logger.warning("⚠️ Batch %s: %d of %d requests failed or returned no result", batch.id, failed, len(prompts))
+        results = [FALLBACK_RESPONSE if result is None else result for result in results]
+        
+        logger.info("✅ Batch %s completed", batch.id)
+        return results
+    
+    def _canned_reply(self, message: str, language: str, system_prompt: str = "") -> Optional[str]:
+        """Local reply for empty messages and bare greetings/thanks, or None when the LLM is needed.
+        
+        Greetings and thanks go to the LLM when the caller set a system prompt (e.g. a persona).
+        """
+        normalized = message.strip().lower().strip("!.?؟ ")
+        if not normalized:
+            return _EMPTY_MESSAGE_REPLY.get(language, _EMPTY_MESSAGE_REPLY["en"])
+        if system_prompt:
+            return None
+        replies = _CANNED_REPLIES.get(normalized)
+        if replies is None:
+            return None
+        return replies.get(language, replies["en"])
+    
+    def _build_messages(self, message: str, system_prompt: str, language: str) -> List[Dict[str, str]]:
+        """
+        System prompt (explicit or language default) followed by the user message.
+        Keep the system prompt stable across calls to benefit from OpenAI prompt caching:
+        put per-request values (IDs, timestamps) in the user message, not the system prompt.
+        """
+        if system_prompt:
+            if not self._dynamic_prompt_warned and _DYNAMIC_PROMPT_RE.search(system_prompt):
+                self._dynamic_prompt_warned = True
+                logger.warning("System prompt contains a UUID or timestamp; this defeats OpenAI prompt caching")
+            return [{"role": "system", "content": system_prompt}, {"role": "user", "content": message}]
+        # Default system prompt based on language
+        return [*_DEFAULT_SYSTEM_MESSAGES.get(language, _DEFAULT_SYSTEM_MESSAGES["en"]), {"role": "user", "content": message}]
+    
+    async def detect_language(self, text: str) -> str:
+        """Language detection, memoized per request (see RequestCacheMiddleware)."""
+        request_cache = get_request_cache()
+        if request_cache is None:
+            return await self._detect_language(text)
+        
+        key = ("detect_language", text)
+        if key not in request_cache:
+            request_cache[key] = await self._detect_language(text)
+        return request_cache[key]
+    
+    async def _detect_language(self, text: str) -> str:
+        """Language detection: local lingua model, OpenAI if configured, else pattern matching."""
+        detector = _get_language_detector() if LANGUAGE_DETECTOR != "openai" else None
+        if detector is not None:
+            detected = detector.detect_language_of(text[:200])
+            return _LINGUA_CODES.get(detected, "en")
+        
+        if not self.client or LANGUAGE_DETECTOR != "openai":
             # Simple pattern-based detection
-            text_lower = text[:200].lower()
+            sample = text[:200]
             
             # Count Arabic characters
-            arabic_chars = sum(1 for char in text_lower if '\u0600' <= char <= '\u06FF')
+            arabic_chars = len(_ARABIC_RE.findall(sample))
             
-            # Common French words
-            french_words = ['le', 'la', 'les', 'un', 'une', 'des', 'et', 'avec', 'pour']
-            french_count = sum(1 for word in french_words if word in text_lower)
+            # Distinct common French words
+            french_count = len(_FRENCH_SET.intersection(_WORD_RE.findall(sample.lower())))
             
             if arabic_chars > 3:
                 return "ar"
@@ -155,9 +660,8 @@ class LLMService:
                 return "en"
         
         try:
-            response = await self.client.chat.completions.create(
-                model=self.model,
-                messages=[
+            response_text = await self._cached_completion(
+                [
                     {
                         "role": "system", 
                         "content": "Detect the language of the following text. Respond with only the ISO 639-1 code (en, ar, fr)."
@@ -165,30 +669,49 @@ class LLMService:
                     {"role": "user", "content": text[:200]}  # Limit text for efficiency
                 ],
                 max_tokens=10,
-                temperature=0.1
+                temperature=0.1,
+                model=self.fast_model or self.model
             )
             
-            detected_language = response.choices[0].message.content.strip().lower()
+            detected_language = response_text.strip().lower()
             
             if detected_language in SUPPORTED_LANGUAGES:
                 return detected_language
             else:
-                logger.warning(f"Unknown language detected: {detected_language}, defaulting to en")
+                logger.warning("Unknown language detected: %s, defaulting to en", detected_language)
                 return "en"
                 
         except Exception as e:
-            logger.error(f"Language detection failed: {str(e)}")
+            logger.error("Language detection failed: %s", e)
             return "en"  # Default to English
 
 
-# Global service instance
-llm_service = LLMService()
+# Global service instance, created on first use so importing this module stays cheap
+_service: Optional[LLMService] = None
+
+
+def get_llm_service() -> LLMService:
+    """Return the global LLM service, creating it on first call."""
+    global _service
+    if _service is None:
+        _service = LLMService()
+    return _service
+
+
+async def close_llm_service() -> None:
+    """Release the global service's connections, if it was ever created."""
+    if _service is not None:
+        await _service.aclose()
 
 # Convenience functions
 async def generate_response(message: str, language: str = "en", system_prompt: str = "") -> str:
     """Generate a response using the global LLM service."""
-    return await llm_service.generate_response(message, system_prompt, language)
+    return await get_llm_service().generate_response(message, system_prompt, language)
+
+def generate_response_stream(message: str, language: str = "en", system_prompt: str = "") -> AsyncIterator[str]:
+    """Stream a response using the global LLM service."""
+    return get_llm_service().generate_response_stream(message, system_prompt, language)
 
 async def test_llm_connection() -> Dict[str, Any]:
     """Test the LLM connection."""
-    return await llm_service.test_connection() 
\ No newline at end of file
+    return await get_llm_service().test_connection()
\ No newline at end of file
@@ -0,0 +1,68 @@
+"""
+Int8 ONNX Runtime drop-in for the SentenceTransformer embedding model
+
+Export and quantize the model once, then point EMBEDDING_ONNX_MODEL at the int8 file
+(tokenizer.json must sit next to it):
+
+    optimum-cli export onnx --model sentence-transformers/all-MiniLM-L6-v2 --optimize O3 ./mini_onnx
+    python -c "from onnxruntime.quantization import quantize_dynamic, QuantType; \\
+        quantize_dynamic('mini_onnx/model.onnx', 'mini_onnx/model.int8.onnx', weight_type=QuantType.QInt8)"
+"""
+
+import os
+from pathlib import Path
+from typing import List, Union
+
+import numpy as np
+
+try:
+    import onnxruntime as ort
+    from tokenizers import Tokenizer
+    ONNX_AVAILABLE = True
+except ImportError:
+    ONNX_AVAILABLE = False
+
+EMBEDDING_ONNX_MODEL = os.getenv("EMBEDDING_ONNX_MODEL", "")
+EMBEDDING_MAX_SEQ_LENGTH = int(os.getenv("EMBEDDING_MAX_SEQ_LENGTH", "256"))
+
+
+class OnnxSentenceEncoder:
+    """Mean-pooled, L2-normalized sentence embeddings from an ONNX export of a
+    SentenceTransformer model. Exposes the subset of ``encode`` this app uses."""
+
+    def __init__(self, model_path: Union[str, Path], max_seq_length: int = EMBEDDING_MAX_SEQ_LENGTH):
+        model_path = Path(model_path)
+        self.tokenizer = Tokenizer.from_file(str(model_path.with_name("tokenizer.json")))
+        self.tokenizer.enable_truncation(max_length=max_seq_length)
+        self.tokenizer.enable_padding()
+
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        self.session = ort.InferenceSession(str(model_path), options, providers=["CPUExecutionProvider"])
+        self._input_names = {node.name for node in self.session.get_inputs()}
+
+    def encode(self, sentences: Union[str, List[str]], batch_size: int = 32, normalize_embeddings: bool = True,
+               **kwargs) -> np.ndarray:
+        """Encode sentences to a float32 (N, D) array (a single string gives a (D,) vector)"""
+        single = isinstance(sentences, str)
+        if single:
+            sentences = [sentences]
+
+        batches = []
+        for start in range(0, len(sentences), batch_size):
+            encodings = self.tokenizer.encode_batch(sentences[start:start + batch_size])
+            input_ids = np.array([e.ids for e in encodings], dtype=np.int64)
+            attention_mask = np.array([e.attention_mask for e in encodings], dtype=np.int64)
+            feeds = {"input_ids": input_ids, "attention_mask": attention_mask}
+            if "token_type_ids" in self._input_names:
+                feeds["token_type_ids"] = np.array([e.type_ids for e in encodings], dtype=np.int64)
+
+            token_embeddings = self.session.run(None, feeds)[0]
+            mask = attention_mask[:, :, None].astype(np.float32)
+            pooled = (token_embeddings * mask).sum(axis=1) / np.maximum(mask.sum(axis=1), 1e-9)
+            if normalize_embeddings:
+                pooled /= np.maximum(np.linalg.norm(pooled, axis=1, keepdims=True), 1e-12)
+            batches.append(pooled.astype(np.float32, copy=False))
+
+        embeddings = np.concatenate(batches) if batches else np.zeros((0, 0), dtype=np.float32)
+        return embeddings[0] if single else embeddings
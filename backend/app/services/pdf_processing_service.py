@@ -3,11 +3,22 @@ Document Processing Service - RAG-based document processing for PDF and Markdown
 """
 
 import os
-import json
+import io
+import asyncio
+import orjson
+import tempfile
+import threading
 import hashlib
+import multiprocessing
+from concurrent.futures import Executor, ProcessPoolExecutor
 from pathlib import Path
-from typing import Dict, List, Any, Optional, Tuple
-from dataclasses import dataclass, asdict
+from typing import Dict, List, Any, Optional, Tuple, BinaryIO, Union
+from collections import Counter
+from contextlib import nullcontext
+from dataclasses import dataclass
+from functools import cached_property, lru_cache
+import msgspec
+from cachetools import LRUCache
 from datetime import datetime
 import logging
 import re
@@ -20,14 +31,19 @@ try:
 except ImportError:
     PDF_AVAILABLE = False
 
+import numpy as np
+
 # ML/AI imports (optional dependencies)
 try:
-    import numpy as np
+    import torch
     from sentence_transformers import SentenceTransformer
     EMBEDDINGS_AVAILABLE = True
 except ImportError:
     EMBEDDINGS_AVAILABLE = False
 
+# Intra-op threads for PyTorch encoding (some environments default to a single thread)
+EMBEDDING_TORCH_THREADS = int(os.getenv("EMBEDDING_TORCH_THREADS", str(os.cpu_count() or 1)))
+
 # Image processing for OCR fallback
 try:
     import pytesseract
@@ -45,11 +61,26 @@ try:
 except ImportError:
     MARKDOWN_AVAILABLE = False
 
+# Approximate nearest-neighbour index for large corpora
+try:
+    import faiss
+    FAISS_AVAILABLE = True
+except ImportError:
+    FAISS_AVAILABLE = False
+
+from .onnx_encoder import ONNX_AVAILABLE, EMBEDDING_ONNX_MODEL, OnnxSentenceEncoder
+from ..utils.hashing import fast_hexdigest
 from ..utils.logging import logger
 
-@dataclass
-class DocumentChunk:
-    """Represents a processed document chunk with metadata"""
+# Fields returned by the document listing, in response order
+DOCUMENT_LIST_FIELDS = ("id", "filename", "file_type", "language", "chunks", "uploaded_at")
+
+class DocumentChunk(msgspec.Struct, gc=False):
+    """Represents a processed document chunk with metadata
+    
+    A msgspec Struct rather than a dataclass: cheaper to construct and not tracked by the
+    cyclic GC (chunks never reference each other).
+    """
     id: str
     content: str
     source_file: str
@@ -59,14 +90,116 @@ class DocumentChunk:
     language: str
     category: str
     metadata: Dict[str, Any]
-    embedding: Optional[List[float]] = None
-    created_at: str = None
+    embedding: Optional[np.ndarray] = None  # float row; legacy chunk files hold JSON lists, decoded to arrays
+    created_at: Optional[str] = None
     relevance_score: float = 0.0
     
     def __post_init__(self):
         if self.created_at is None:
             self.created_at = datetime.now().isoformat()
 
+# SentenceTransformer model used when no ONNX export is configured
+EMBEDDING_MODEL = os.getenv("EMBEDDING_MODEL", "all-MiniLM-L6-v2")
+
+# Chunks are length-sorted before encoding, so larger batches waste little on padding
+EMBEDDING_BATCH_SIZE = int(os.getenv("EMBEDDING_BATCH_SIZE", "64"))
+
+# Index changes appended to documents_index.ndjson before compacting into the JSON snapshot
+DOCUMENT_INDEX_COMPACT_EVERY = int(os.getenv("DOCUMENT_INDEX_COMPACT_EVERY", "1000"))
+# Index changes made within this many seconds are appended to the log in one write
+DOCUMENT_INDEX_FLUSH_DELAY = float(os.getenv("DOCUMENT_INDEX_FLUSH_DELAY", "0.5"))
+
+# Query caches for search: normalized-text embedding LRU (L1) and nearest-query result cache (L2)
+QUERY_EMBEDDING_CACHE_SIZE = int(os.getenv("SEARCH_QUERY_EMBEDDING_CACHE_SIZE", "1024"))
+SEMANTIC_CACHE_SIZE = int(os.getenv("SEARCH_SEMANTIC_CACHE_SIZE", "256"))
+SEMANTIC_CACHE_THRESHOLD = float(os.getenv("SEARCH_SEMANTIC_CACHE_THRESHOLD", "0.95"))
+
+# FAISS search: exact inner product below FAISS_HNSW_MIN_VECTORS, HNSW graph above. Filtered
+# searches fetch FAISS_OVERSAMPLE x max_results neighbours before dropping non-matching chunks.
+FAISS_HNSW_MIN_VECTORS = int(os.getenv("FAISS_HNSW_MIN_VECTORS", "10000"))
+FAISS_HNSW_M = int(os.getenv("FAISS_HNSW_M", "32"))
+FAISS_OVERSAMPLE = int(os.getenv("FAISS_OVERSAMPLE", "4"))
+
+class SemanticResultCache:
+    """Search results of recent queries, reused for any new query whose normalized embedding
+    has cosine >= threshold with a cached one under the same search parameters. LRU eviction."""
+    
+    def __init__(self, capacity: int, threshold: float):
+        self.capacity = capacity
+        self.threshold = threshold
+        self._lock = threading.RLock()  # searches run in worker threads
+        self.clear()
+    
+    def clear(self):
+        with self._lock:
+            self._vectors: Optional[np.ndarray] = None  # (capacity, D) normalized query embeddings
+            self._entries: List[Tuple[Any, List[DocumentChunk]]] = []  # (params, results) per row
+            self._last_used = np.zeros(max(self.capacity, 0), dtype=np.int64)
+            self._clock = 0
+    
+    def get(self, query_vec: np.ndarray, params: Any) -> Optional[List[DocumentChunk]]:
+        with self._lock:
+            if not self._entries or self._vectors.shape[1] != query_vec.shape[0]:
+                return None
+            sims = self._vectors[:len(self._entries)] @ query_vec
+            for row in np.argsort(-sims):
+                if sims[row] < self.threshold:
+                    break
+                if self._entries[row][0] == params:
+                    self._clock += 1
+                    self._last_used[row] = self._clock
+                    return self._entries[row][1]
+            return None
+    
+    def put(self, query_vec: np.ndarray, params: Any, results: List[DocumentChunk]):
+        with self._lock:
+            if self.capacity <= 0:
+                return
+            if self._vectors is None or self._vectors.shape[1] != query_vec.shape[0]:
+                self.clear()
+                self._vectors = np.zeros((self.capacity, query_vec.shape[0]), dtype=np.float32)
+            if len(self._entries) < self.capacity:
+                row = len(self._entries)
+                self._entries.append((params, results))
+            else:
+                row = int(np.argmin(self._last_used))
+                self._entries[row] = (params, results)
+            self._vectors[row] = query_vec
+            self._clock += 1
+            self._last_used[row] = self._clock
+
+@dataclass(frozen=True)
+class ChunkStore:
+    """Column-oriented search corpus: chunk i is row i of every array"""
+    chunks: List[DocumentChunk]
+    matrix: Optional[np.ndarray]  # L2-normalized (N, D) float32 rows, None without embeddings
+    has_embedding: np.ndarray  # False for chunks stored without an embedding (zero rows)
+    language_names: List[str]  # distinct languages; language_codes index into this list
+    language_codes: np.ndarray
+    category_names: List[str]  # distinct categories; category_codes index into this list
+    category_codes: np.ndarray
+    ann_index: Any = None  # FAISS index over `matrix`, when available
+    
+    def filter_rows(self, language: Optional[str], category: Optional[str]) -> np.ndarray:
+        """Row indices matching the language and category filters (None/empty = any)"""
+        mask = np.ones(len(self.chunks), dtype=bool)
+        for value, names, codes in ((language, self.language_names, self.language_codes),
+                                    (category, self.category_names, self.category_codes)):
+            if value:
+                if value not in names:
+                    return np.empty(0, dtype=np.intp)
+                mask &= codes == names.index(value)
+        return np.flatnonzero(mask)
+
+def _decode_ndarray(type_: type, obj: Any) -> Any:
+    """msgspec hook: legacy inline embedding lists become float32 arrays"""
+    if type_ is np.ndarray:
+        return np.asarray(obj, dtype=np.float32)
+    raise NotImplementedError(f"Unsupported type: {type_}")
+
+# Typed decoder: builds DocumentChunk structs directly from JSON bytes, without intermediate dicts
+_CHUNK_LIST_DECODER = msgspec.json.Decoder(List[DocumentChunk], dec_hook=_decode_ndarray)
+
 @dataclass
 class ProcessingResult:
     """Result of document processing operation"""
@@ -86,6 +219,52 @@ class ProcessingResult:
         if self.chunks is None:
             self.chunks = []
 
+# Markdown ATX header at the start of a line (horizontal whitespace only after the hashes)
+_HEADER_RE = re.compile(r'^(#{1,6})[^\S\n]+(.+)$', re.MULTILINE)
+
+# Sentence boundaries used by the text chunker
+_SENT_RE = re.compile(r'[.!?]+')
+
+# Common French words used by the language heuristic
+_FRENCH_WORD_RE = re.compile(r'\b(?:le|la|des|une|avec|pour|dans|sur|est|sont)\b', re.IGNORECASE)
+
+# PDFs with at least this many pages are extracted across a process pool
+PDF_PARALLEL_MIN_PAGES = int(os.getenv("PDF_PARALLEL_MIN_PAGES", "4"))
+PDF_EXTRACT_WORKERS = int(os.getenv("PDF_EXTRACT_WORKERS", str(os.cpu_count() or 1)))
+_pdf_pool: Optional[ProcessPoolExecutor] = None
+
+def _get_pdf_pool() -> ProcessPoolExecutor:
+    """Process pool for PDF text extraction, started on first use
+    
+    Workers are spawned rather than forked: by now the process runs thread pools and torch
+    threads, and a forked child can inherit one of their locks held forever.
+    """
+    global _pdf_pool
+    if _pdf_pool is None:
+        _pdf_pool = ProcessPoolExecutor(max_workers=PDF_EXTRACT_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+    return _pdf_pool
+
+def _shutdown_pdf_pool():
+    """Stop the PDF extraction workers, dropping queued work"""
+    global _pdf_pool
+    if _pdf_pool is not None:
+        _pdf_pool.shutdown(wait=False, cancel_futures=True)
+        _pdf_pool = None
+
+def _extract_pdf_pages(doc, start: int, stop: int) -> List[str]:
+    """Tagged text of the non-empty pages in [start, stop) of an open fitz document"""
+    page_texts = []
+    for page_num in range(start, stop):
+        page_text = doc[page_num].get_text()
+        if page_text.strip():
+            page_texts.append(f"[Page {page_num + 1}]\n{page_text}\n")
+    return page_texts
+
+def _extract_pdf_page_range(path: str, start: int, stop: int) -> List[str]:
+    """Process-pool entry point: open the PDF in the worker and extract one page range"""
+    with fitz.open(path) as doc:
+        return _extract_pdf_pages(doc, start, stop)
+
 class DocumentProcessingService:
     """
     Multi-format document processing service supporting PDF, Markdown, and text files
@@ -100,47 +279,250 @@ class DocumentProcessingService:
         self.embeddings_dir.mkdir(parents=True, exist_ok=True)
         self.processed_dir.mkdir(parents=True, exist_ok=True)
         
-        # Initialize embedding model
-        self.embedding_model = None
-        if EMBEDDINGS_AVAILABLE:
-            try:
-                self.embedding_model = SentenceTransformer('all-MiniLM-L6-v2')
-                logger.info("Embedding model loaded successfully")
-            except Exception as e:
-                logger.warning(f"Failed to load embedding model: {e}")
+        # (chunk-file signature, ChunkStore) for search
+        self._search_cache = None
+        self._search_lock = threading.Lock()  # searches run in worker threads: guards corpus rebuilds and the query cache
+        self._query_embedding_cache = LRUCache(maxsize=QUERY_EMBEDDING_CACHE_SIZE)
+        self._result_cache = SemanticResultCache(SEMANTIC_CACHE_SIZE, SEMANTIC_CACHE_THRESHOLD)
+        # chunk file name -> (mtime_ns, decoded chunks), so an upload only decodes the new shard
+        self._shard_cache: Dict[str, Tuple[int, List[DocumentChunk]]] = {}
         
-        # Load existing document index
+        # Load existing document index (snapshot plus append-log replay)
+        self.index_file = self.processed_dir / "documents_index.json"
+        self.index_log_file = self.processed_dir / "documents_index.ndjson"
+        self._index_log_entries = 0
+        self._pending_index_entries: List[Dict[str, Any]] = []
+        self._index_lock = threading.Lock()
+        self._index_flush_task: Optional[asyncio.Task] = None
         self.document_index = self._load_document_index()
         
+        # Columnar projection of the index for listing, kept in sync on upload/delete
+        self._doc_columns: Dict[str, List[Any]] = {field: [] for field in DOCUMENT_LIST_FIELDS}
+        # Running totals for get_document_stats, kept in sync on upload/delete
+        self._stats_chunks = 0
+        self._stats_counters = {"categories": Counter(), "languages": Counter(), "file_types": Counter()}
+        self._storage_bytes: Optional[int] = None  # scanned once on the first stats call
+        self._loaded_model_id: Optional[str] = None  # set once embedding_model has loaded
+        self._model_lock = threading.Lock()
+        for doc_id, doc_info in self.document_index.get("documents", {}).items():
+            self._add_document_columns(doc_id, doc_info)
+            self._count_document(doc_info, 1)
+        
         logger.info(f"Document processing service initialized (PDF: {PDF_AVAILABLE}, Markdown: {MARKDOWN_AVAILABLE}, Embeddings: {EMBEDDINGS_AVAILABLE})")
     
+    @cached_property
+    def embedding_model(self):
+        """Sentence embedding model, loaded on first use (None if unavailable)
+        
+        Uses the int8 ONNX export at EMBEDDING_ONNX_MODEL when configured, else PyTorch.
+        """
+        # cached_property has no lock since Python 3.12, and the first access may come from
+        # several worker threads at once; only one of them loads the model
+        with self._model_lock:
+            if "embedding_model" in self.__dict__:
+                return self.__dict__["embedding_model"]
+            return self._load_embedding_model()
+    
+    def _load_embedding_model(self):
+        if EMBEDDING_ONNX_MODEL and ONNX_AVAILABLE:
+            try:
+                model = OnnxSentenceEncoder(EMBEDDING_ONNX_MODEL)
+                self._loaded_model_id = f"onnx:{EMBEDDING_ONNX_MODEL}"
+                logger.info(f"ONNX embedding model loaded from {EMBEDDING_ONNX_MODEL}")
+                return model
+            except Exception as e:
+                logger.warning(f"Failed to load ONNX embedding model, falling back to PyTorch: {e}")
+        
+        if not EMBEDDINGS_AVAILABLE:
+            return None
+        try:
+            model = SentenceTransformer(EMBEDDING_MODEL)
+            self._loaded_model_id = f"torch:{EMBEDDING_MODEL}"
+            torch.set_num_threads(EMBEDDING_TORCH_THREADS)
+            try:
+                torch.set_num_interop_threads(2)
+            except RuntimeError:
+                pass  # only settable before the first parallel op
+            logger.info("Embedding model loaded successfully")
+            return model
+        except Exception as e:
+            logger.warning(f"Failed to load embedding model: {e}")
+            return None
+    
+    @property
+    def embedding_model_id(self) -> str:
+        """Backend and model behind ``embedding_model``; the configured one until it has loaded"""
+        if self._loaded_model_id is not None:
+            return self._loaded_model_id
+        if EMBEDDING_ONNX_MODEL and ONNX_AVAILABLE:
+            return f"onnx:{EMBEDDING_ONNX_MODEL}"
+        return f"torch:{EMBEDDING_MODEL}"
+    
+    def _inference_mode(self):
+        """Autograd-free context for encode calls (a no-op for the ONNX encoder)"""
+        return torch.inference_mode() if EMBEDDINGS_AVAILABLE else nullcontext()
+    
     def _load_document_index(self) -> Dict[str, Any]:
-        """Load existing document index"""
-        index_file = self.processed_dir / "documents_index.json"
-        if index_file.exists():
+        """Load the index snapshot, then replay the append log over it (newest entry wins)"""
+        index = {"documents": {}, "last_updated": datetime.now().isoformat()}
+        if self.index_file.exists():
             try:
-                with open(index_file, 'r', encoding='utf-8') as f:
-                    return json.load(f)
+                index = orjson.loads(self.index_file.read_bytes())
             except Exception as e:
                 logger.warning(f"Failed to load document index: {e}")
-        return {"documents": {}, "last_updated": datetime.now().isoformat()}
+        
+        if self.index_log_file.exists():
+            for line in self.index_log_file.read_bytes().splitlines():
+                if not line.strip():
+                    continue
+                try:
+                    entry = orjson.loads(line)
+                except orjson.JSONDecodeError:
+                    logger.warning("Skipping malformed document index log entry")  # e.g. a torn final write
+                    continue
+                if entry["op"] == "delete":
+                    index["documents"].pop(entry["id"], None)
+                else:
+                    index["documents"][entry["id"]] = entry["info"]
+                index["last_updated"] = entry["ts"]
+                self._index_log_entries += 1
+        return index
+    
+    def _log_document_index(self, op: str, document_id: str, doc_info: Optional[Dict[str, Any]] = None):
+        """Queue one index change for the append log
+        
+        Inside the event loop, queued changes are written by a debounced background flush, so
+        a burst of uploads costs one append; without a running loop they are written at once.
+        """
+        entry = {"op": op, "id": document_id, "ts": datetime.now().isoformat()}
+        if doc_info is not None:
+            entry["info"] = doc_info
+        self.document_index["last_updated"] = entry["ts"]
+        with self._index_lock:
+            self._pending_index_entries.append(entry)
+        
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            self._write_index_entries()
+            return
+        if self._index_flush_task is None or self._index_flush_task.done():
+            self._index_flush_task = loop.create_task(self._flush_document_index_later())
+    
+    async def _flush_document_index_later(self):
+        """Debounced flush: wait for further changes, then append them all off the event loop"""
+        await asyncio.sleep(DOCUMENT_INDEX_FLUSH_DELAY)
+        await asyncio.to_thread(self._write_index_entries)
+    
+    def _write_index_entries(self):
+        """Append queued index changes in one write; compacts every DOCUMENT_INDEX_COMPACT_EVERY entries"""
+        with self._index_lock:
+            entries, self._pending_index_entries = self._pending_index_entries, []
+            if not entries:
+                return
+            try:
+                with open(self.index_log_file, 'ab') as f:
+                    f.write(b"".join(orjson.dumps(entry) + b"\n" for entry in entries))
+                self._index_log_entries += len(entries)
+            except Exception as e:
+                logger.error(f"Failed to append to document index log: {e}")
+                self._save_document_index()
+                return
+            
+            if self._index_log_entries >= DOCUMENT_INDEX_COMPACT_EVERY:
+                self._save_document_index()
+    
+    async def aclose(self):
+        """Write any index changes still waiting for the debounced flush"""
+        if self._index_flush_task is not None and not self._index_flush_task.done():
+            self._index_flush_task.cancel()
+        await asyncio.to_thread(self._write_index_entries)
     
     def _save_document_index(self):
-        """Save document index to file"""
-        index_file = self.processed_dir / "documents_index.json"
-        self.document_index["last_updated"] = datetime.now().isoformat()
+        """Write a full index snapshot and truncate the append log it now covers"""
         try:
-            with open(index_file, 'w', encoding='utf-8') as f:
-                json.dump(self.document_index, f, indent=2, ensure_ascii=False)
+            # The snapshot stays human-readable; write then rename so readers never see a partial file
+            tmp_file = self.index_file.with_name(f"{self.index_file.name}.{os.getpid()}.tmp")
+            tmp_file.write_bytes(orjson.dumps(self.document_index, option=orjson.OPT_INDENT_2 | orjson.OPT_NON_STR_KEYS))
+            os.replace(tmp_file, self.index_file)
+            # Replaying entries over a newer snapshot is idempotent, so a crash here loses nothing
+            self.index_log_file.write_bytes(b"")
+            self._index_log_entries = 0
         except Exception as e:
             logger.error(f"Failed to save document index: {e}")
     
-    async def upload_and_process_file(self, file_content: bytes, filename: str, 
+    def _add_document_columns(self, document_id: str, doc_info: Dict[str, Any]):
+        """Append a document to the columnar listing projection"""
+        columns = self._doc_columns
+        columns["id"].append(document_id)
+        columns["filename"].append(doc_info["filename"])
+        columns["file_type"].append(doc_info["file_type"])
+        columns["language"].append(doc_info["language"])
+        columns["chunks"].append(doc_info["total_chunks"])
+        columns["uploaded_at"].append(doc_info["created_at"])
+    
+    def _remove_document_columns(self, document_id: str):
+        """Drop a document from the columnar listing projection"""
+        try:
+            position = self._doc_columns["id"].index(document_id)
+        except ValueError:
+            return
+        for column in self._doc_columns.values():
+            del column[position]
+    
+    def _count_document(self, doc_info: Dict[str, Any], delta: int):
+        """Add (delta=1) or remove (delta=-1) a document from the running stats totals"""
+        self._stats_chunks += delta * doc_info.get("total_chunks", 0)
+        for counter, key in ((self._stats_counters["categories"], doc_info.get("category", "unknown")),
+                             (self._stats_counters["languages"], doc_info.get("language", "unknown")),
+                             (self._stats_counters["file_types"], doc_info.get("file_type", "unknown"))):
+            counter[key] += delta
+            if counter[key] <= 0:
+                del counter[key]
+    
+    def _shard_bytes(self, document_id: str) -> int:
+        """On-disk size of a document's chunk and embedding shards"""
+        size = 0
+        for shard_file in (self.embeddings_dir / f"{document_id}_chunks.json", self.embeddings_dir / f"{document_id}_emb.npy"):
+            try:
+                size += shard_file.stat().st_size
+            except FileNotFoundError:
+                pass
+        return size
+    
+    def list_documents(self) -> List[Dict[str, Any]]:
+        """List indexed documents as rows built from the columnar projection"""
+        columns = [self._doc_columns[field] for field in DOCUMENT_LIST_FIELDS]
+        return [dict(zip(DOCUMENT_LIST_FIELDS, row)) for row in zip(*columns)]
+    
+    def delete_document(self, document_id: str) -> bool:
+        """Delete a document's chunks and index entry; returns False if it is unknown"""
+        if document_id not in self.document_index.get("documents", {}):
+            return False
+        
+        if self._storage_bytes is not None:
+            self._storage_bytes -= self._shard_bytes(document_id)
+        for shard_file in (self.embeddings_dir / f"{document_id}_chunks.json", self.embeddings_dir / f"{document_id}_emb.npy"):
+            if shard_file.exists():
+                shard_file.unlink()
+        
+        self._shard_cache.pop(f"{document_id}_chunks.json", None)
+        self._count_document(self.document_index["documents"].pop(document_id), -1)
+        self._remove_document_columns(document_id)
+        self._log_document_index("delete", document_id)
+        return True
+    
+    async def upload_and_process_file(self, file: Union[bytes, BinaryIO], filename: str, 
                                     category: str = "general", language: str = "auto") -> ProcessingResult:
         """
         Upload and process a document file (PDF or Markdown)
+        
+        ``file`` is a binary file-like object positioned at the start of the content
+        (raw bytes are accepted for backward compatibility).
         """
         start_time = datetime.now()
+        if isinstance(file, bytes):
+            file = io.BytesIO(file)
         
         try:
             # Determine file type
@@ -148,19 +530,19 @@ class DocumentProcessingService:
             if file_ext == '.pdf':
                 if not PDF_AVAILABLE:
                     raise Exception("PDF processing not available - missing dependencies")
-                result = await self._process_pdf_file(file_content, filename, category, language)
+                result = await self._process_pdf_file(file, filename, category, language)
             elif file_ext in ['.md', '.markdown']:
                 if not MARKDOWN_AVAILABLE:
                     raise Exception("Markdown processing not available - missing dependencies")
-                result = await self._process_markdown_file(file_content, filename, category, language)
+                result = await self._process_markdown_file(file, filename, category, language)
             elif file_ext == '.txt':
-                result = await self._process_text_file(file_content, filename, category, language)
+                result = await self._process_text_file(file, filename, category, language)
             else:
                 raise Exception(f"Unsupported file type: {file_ext}")
             
             if result.success:
                 # Update document index
-                self.document_index["documents"][result.document_id] = {
+                doc_info = {
                     "filename": result.file_name,
                     "file_type": result.file_type,
                     "category": result.category,
@@ -168,7 +550,14 @@ class DocumentProcessingService:
                     "total_chunks": result.total_chunks,
                     "created_at": datetime.now().isoformat()
                 }
-                self._save_document_index()
+                previous = self.document_index["documents"].get(result.document_id)
+                if previous is not None:
+                    self._count_document(previous, -1)
+                self._remove_document_columns(result.document_id)
+                self.document_index["documents"][result.document_id] = doc_info
+                self._add_document_columns(result.document_id, doc_info)
+                self._count_document(doc_info, 1)
+                self._log_document_index("put", result.document_id, doc_info)
                 
                 logger.info(f"Document processed successfully: {filename} -> {result.total_chunks} chunks")
             
@@ -191,56 +580,45 @@ class DocumentProcessingService:
                 error_message=error_msg
             )
     
-    async def _process_pdf_file(self, file_content: bytes, filename: str, 
+    async def _process_pdf_file(self, file: BinaryIO, filename: str, 
                               category: str, language: str) -> ProcessingResult:
         """Process PDF file"""
-        # Save temporary file
-        temp_file = self.processed_dir / f"temp_{hashlib.md5(file_content).hexdigest()}.pdf"
-        with open(temp_file, 'wb') as f:
-            f.write(file_content)
+        # PyMuPDF and PyPDF2 both read from memory, so no temp file is needed
+        text_content, total_pages = await self._extract_text_from_pdf(file.read())
         
-        try:
-            # Extract text
-            text_content, total_pages = await self._extract_text_from_pdf(temp_file)
-            
-            # Auto-detect language if needed
-            if language == "auto":
-                language = await self._detect_language(text_content)
-            
-            # Create chunks
-            chunks = await self._create_text_chunks(text_content, filename, "pdf", category, language)
-            
-            # Generate embeddings
-            if self.embedding_model:
-                await self._generate_embeddings(chunks)
-            
-            # Save chunks
-            document_id = await self._save_chunks(chunks)
-            
-            return ProcessingResult(
-                success=True,
-                document_id=document_id,
-                file_name=filename,
-                file_type="pdf",
-                total_pages=total_pages,
-                total_chunks=len(chunks),
-                language_detected=language,
-                category=category,
-                processing_time=0,
-                chunks=chunks
-            )
-            
-        finally:
-            # Clean up temp file
-            if temp_file.exists():
-                temp_file.unlink()
+        # Auto-detect language if needed
+        if language == "auto":
+            language = await self._detect_language(text_content)
+        
+        # Create chunks
+        chunks = await self._create_text_chunks(text_content, filename, "pdf", category, language)
+        
+        # Generate embeddings
+        if self.embedding_model:
+            await self._generate_embeddings(chunks)
+        
+        # Save chunks
+        document_id = await self._save_chunks(chunks)
+        
+        return ProcessingResult(
+            success=True,
+            document_id=document_id,
+            file_name=filename,
+            file_type="pdf",
+            total_pages=total_pages,
+            total_chunks=len(chunks),
+            language_detected=language,
+            category=category,
+            processing_time=0,
+            chunks=chunks
+        )
     
-    async def _process_markdown_file(self, file_content: bytes, filename: str, 
+    async def _process_markdown_file(self, file: BinaryIO, filename: str, 
                                    category: str, language: str) -> ProcessingResult:
         """Process Markdown file"""
         try:
             # Decode content
-            text_content = file_content.decode('utf-8')
+            text_content = file.read().decode('utf-8')
             
             # Auto-detect language if needed
             if language == "auto":
@@ -251,8 +629,9 @@ class DocumentProcessingService:
             
             # Create chunks from sections
             chunks = []
+            document_id = self._document_id(filename)
             for i, section in enumerate(sections):
-                chunk_id = f"{hashlib.md5(filename.encode()).hexdigest()}_{i}"
+                chunk_id = f"{document_id}_{i}"
                 chunk = DocumentChunk(
                     id=chunk_id,
                     content=section["content"],
@@ -293,12 +672,12 @@ class DocumentProcessingService:
         except Exception as e:
             raise Exception(f"Markdown processing failed: {str(e)}")
     
-    async def _process_text_file(self, file_content: bytes, filename: str, 
+    async def _process_text_file(self, file: BinaryIO, filename: str, 
                                category: str, language: str) -> ProcessingResult:
         """Process plain text file"""
         try:
             # Decode content
-            text_content = file_content.decode('utf-8')
+            text_content = file.read().decode('utf-8')
             
             # Auto-detect language if needed
             if language == "auto":
@@ -333,31 +712,20 @@ class DocumentProcessingService:
     async def _parse_markdown_sections(self, content: str) -> List[Dict[str, Any]]:
         """Parse markdown content into logical sections"""
         sections = []
-        lines = content.split('\n')
-        current_section = {"title": "", "content": "", "level": 1}
-        
-        for line in lines:
-            # Check for headers
-            header_match = re.match(r'^(#{1,6})\s+(.+)$', line)
-            if header_match:
-                # Save previous section if it has content
-                if current_section["content"].strip():
-                    sections.append(current_section.copy())
-                
-                # Start new section
-                level = len(header_match.group(1))
-                title = header_match.group(2)
-                current_section = {
-                    "title": title,
-                    "content": line + "\n",
-                    "level": level
-                }
-            else:
-                current_section["content"] += line + "\n"
         
-        # Add last section
-        if current_section["content"].strip():
-            sections.append(current_section)
+        # One C-level scan finds every header; each section is the slice up to the next header
+        headers = list(_HEADER_RE.finditer(content))
+        starts = [0] + [match.start() for match in headers]
+        ends = starts[1:] + [len(content)]
+        titles = [("", 1)] + [(match.group(2), len(match.group(1))) for match in headers]
+        
+        for start, end, (title, level) in zip(starts, ends, titles):
+            section_content = content[start:end]
+            if end == len(content):
+                section_content += "\n"  # every line, including the last, ends with a newline
+            # Save section if it has content
+            if section_content.strip():
+                sections.append({"title": title, "content": section_content, "level": level})
         
         # If no sections found, treat entire content as one section
         if not sections:
@@ -369,21 +737,18 @@ class DocumentProcessingService:
         
         return sections
     
-    async def _extract_text_from_pdf(self, file_path: Path) -> Tuple[str, int]:
-        """Extract text from PDF using multiple methods"""
+    async def _extract_text_from_pdf(self, pdf_bytes: bytes) -> Tuple[str, int]:
+        """Extract text from in-memory PDF bytes using multiple methods"""
         try:
             # Method 1: PyMuPDF (fitz) - preferred for better text extraction
-            doc = fitz.open(file_path)
-            total_pages = doc.page_count
+            with fitz.open(stream=pdf_bytes, filetype="pdf") as doc:
+                total_pages = doc.page_count
+                if total_pages < PDF_PARALLEL_MIN_PAGES:
+                    page_texts = _extract_pdf_pages(doc, 0, total_pages)
             
-            page_texts = []
-            for page_num in range(total_pages):
-                page = doc[page_num]
-                page_text = page.get_text()
-                if page_text.strip():
-                    page_texts.append(f"[Page {page_num + 1}]\n{page_text}\n")
+            if total_pages >= PDF_PARALLEL_MIN_PAGES:
+                page_texts = await self._extract_pdf_pages_parallel(pdf_bytes, total_pages)
             
-            doc.close()
             text_content = "\n".join(page_texts)
             
         except Exception as e:
@@ -391,37 +756,57 @@ class DocumentProcessingService:
             
             # Method 2: PyPDF2 fallback
             try:
-                with open(file_path, 'rb') as file:
-                    pdf_reader = PyPDF2.PdfReader(file)
-                    total_pages = len(pdf_reader.pages)
-                    
-                    page_texts = []
-                    for page_num, page in enumerate(pdf_reader.pages):
-                        try:
-                            page_text = page.extract_text()
-                            if page_text.strip():
-                                page_texts.append(f"[Page {page_num + 1}]\n{page_text}\n")
-                        except Exception as page_e:
-                            logger.warning(f"Failed to extract text from page {page_num + 1}: {page_e}")
-                    
-                    text_content = "\n".join(page_texts)
-                    
+                pdf_reader = PyPDF2.PdfReader(io.BytesIO(pdf_bytes))
+                total_pages = len(pdf_reader.pages)
+                
+                page_texts = []
+                for page_num, page in enumerate(pdf_reader.pages):
+                    try:
+                        page_text = page.extract_text()
+                        if page_text.strip():
+                            page_texts.append(f"[Page {page_num + 1}]\n{page_text}\n")
+                    except Exception as page_e:
+                        logger.warning(f"Failed to extract text from page {page_num + 1}: {page_e}")
+                
+                text_content = "\n".join(page_texts)
+                
             except Exception as e2:
                 logger.error(f"PyPDF2 extraction also failed: {e2}")
                 raise Exception("Failed to extract text from PDF using all available methods")
         
         return text_content, total_pages
     
+    async def _extract_pdf_pages_parallel(self, pdf_bytes: bytes, total_pages: int) -> List[str]:
+        """Extract a large PDF across the process pool, one contiguous page range per worker"""
+        # Workers open the PDF by path, so spill it to disk once rather than pickling it per worker
+        with tempfile.NamedTemporaryFile(dir=self.processed_dir, prefix="temp_", suffix=".pdf", delete=False) as f:
+            f.write(pdf_bytes)
+        temp_file = Path(f.name)
+        
+        try:
+            workers = min(PDF_EXTRACT_WORKERS, total_pages)
+            bounds = np.linspace(0, total_pages, workers + 1, dtype=int)
+            loop = asyncio.get_running_loop()
+            page_ranges = await asyncio.gather(*(
+                loop.run_in_executor(_get_pdf_pool(), _extract_pdf_page_range, str(temp_file), int(start), int(stop))
+                for start, stop in zip(bounds[:-1], bounds[1:])
+            ))
+        finally:
+            temp_file.unlink(missing_ok=True)
+        
+        return [text for page_range in page_ranges for text in page_range]
+    
     async def _detect_language(self, text: str) -> str:
         """
         Auto-detect language based on text characteristics
         """
-        text_sample = text[:1000].lower()
+        text_sample = text[:1000]
         
-        # Simple heuristics for language detection
-        arabic_chars = sum(1 for char in text_sample if '\u0600' <= char <= '\u06FF')
-        french_words = ['le', 'la', 'des', 'une', 'avec', 'pour', 'dans', 'sur', 'est', 'sont']
-        french_count = sum(1 for word in french_words if word in text_sample)
+        # Simple heuristics for language detection: Arabic codepoints counted in one vector
+        # comparison, distinct French stop words found in one regex scan
+        codepoints = np.frombuffer(text_sample.encode('utf-32-le'), dtype=np.uint32)
+        arabic_chars = int(np.count_nonzero((codepoints >= 0x0600) & (codepoints <= 0x06FF)))
+        french_count = len({word.lower() for word in _FRENCH_WORD_RE.findall(text_sample)})
         
         # Arabic: significant Arabic characters
         if arabic_chars > 10:
@@ -433,56 +818,50 @@ class DocumentProcessingService:
         else:
             return "en"
     
+    def _document_id(self, filename: str) -> str:
+        """Document ID for a filename, so re-uploading a file replaces the stored copy
+        
+        IDs are xxh3 digests; a document stored by an older version keeps its md5 (or, from
+        installs without xxhash, BLAKE2b) ID so the re-upload still matches it.
+        """
+        data = filename.encode()
+        documents = self.document_index["documents"]
+        for legacy_id in (hashlib.md5(data).hexdigest(), hashlib.blake2b(data, digest_size=8).hexdigest()):
+            if legacy_id in documents:
+                return legacy_id
+        return fast_hexdigest(data)
+    
     async def _create_text_chunks(self, text: str, filename: str, source_type: str, 
                                 category: str, language: str) -> List[DocumentChunk]:
         """Create text chunks with overlap for better context"""
         chunk_size = 1000
         overlap = 200
         chunks = []
+        document_id = self._document_id(filename)
         
-        # Split text into sentences for better chunking
-        sentences = re.split(r'[.!?]+', text)
-        current_chunk = ""
-        chunk_index = 0
+        # Split text into sentences once; each chunk is a contiguous window of sentences
+        sentences = [sentence.strip() for sentence in _SENT_RE.split(text)]
+        sentences = [sentence for sentence in sentences if sentence]
+        if not sentences:
+            return chunks
         
-        for sentence in sentences:
-            sentence = sentence.strip()
-            if not sentence:
-                continue
-                
-            # Check if adding this sentence would exceed chunk size
-            if len(current_chunk) + len(sentence) > chunk_size and current_chunk:
-                # Create chunk
-                chunk_id = f"{hashlib.md5(filename.encode()).hexdigest()}_{chunk_index}"
-                chunk = DocumentChunk(
-                    id=chunk_id,
-                    content=current_chunk.strip(),
-                    source_file=filename,
-                    source_type=source_type,
-                    page_number=None,
-                    chunk_index=chunk_index,
-                    language=language,
-                    category=category,
-                    metadata={
-                        "word_count": len(current_chunk.split()),
-                        "char_count": len(current_chunk)
-                    }
-                )
-                chunks.append(chunk)
-                
-                # Start new chunk with overlap
-                overlap_text = current_chunk[-overlap:] if len(current_chunk) > overlap else current_chunk
-                current_chunk = overlap_text + " " + sentence
-                chunk_index += 1
-            else:
-                current_chunk += " " + sentence if current_chunk else sentence
-        
-        # Add final chunk
-        if current_chunk.strip():
-            chunk_id = f"{hashlib.md5(filename.encode()).hexdigest()}_{chunk_index}"
-            chunk = DocumentChunk(
-                id=chunk_id,
-                content=current_chunk.strip(),
+        # Prefix sums of sentence lengths (plus the joining space) and word counts
+        char_sums = np.zeros(len(sentences) + 1, dtype=np.int64)
+        np.cumsum([len(sentence) + 1 for sentence in sentences], out=char_sums[1:])
+        word_sums = np.zeros(len(sentences) + 1, dtype=np.int64)
+        np.cumsum([sentence.count(' ') + 1 for sentence in sentences], out=word_sums[1:])
+        
+        start = 0
+        chunk_index = 0
+        while start < len(sentences):
+            # Widest window starting at `start` that fits in chunk_size (always at least one sentence)
+            end = int(np.searchsorted(char_sums, char_sums[start] + chunk_size, side="right")) - 1
+            end = max(end, start + 1)
+            
+            content = " ".join(sentences[start:end])
+            chunks.append(DocumentChunk(
+                id=f"{document_id}_{chunk_index}",
+                content=content,
                 source_file=filename,
                 source_type=source_type,
                 page_number=None,
@@ -490,11 +869,17 @@ class DocumentProcessingService:
                 language=language,
                 category=category,
                 metadata={
-                    "word_count": len(current_chunk.split()),
-                    "char_count": len(current_chunk)
+                    "word_count": int(word_sums[end] - word_sums[start]),
+                    "char_count": len(content)
                 }
-            )
-            chunks.append(chunk)
+            ))
+            chunk_index += 1
+            
+            if end == len(sentences):
+                break
+            # Overlap: step back over the trailing sentences that fit in `overlap` chars
+            overlap_start = int(np.searchsorted(char_sums, char_sums[end] - overlap, side="left"))
+            start = min(max(overlap_start, start + 1), end)
         
         return chunks
     
@@ -505,30 +890,59 @@ class DocumentProcessingService:
             return
         
         try:
+            # Encode in length order so each batch pads to similar lengths, then restore chunk order
             texts = [chunk.content for chunk in chunks]
-            embeddings = self.embedding_model.encode(texts, batch_size=32, show_progress_bar=False)
+            order = np.argsort([len(text) for text in texts], kind="stable")
+            with self._inference_mode():
+                sorted_embeddings = self.embedding_model.encode(
+                    [texts[i] for i in order], batch_size=EMBEDDING_BATCH_SIZE, show_progress_bar=False,
+                    convert_to_numpy=True, normalize_embeddings=True
+                )
+            embeddings = np.empty_like(sorted_embeddings)
+            embeddings[order] = sorted_embeddings
+            # Unit rows (whatever the encoder did), so search scores them with a plain dot product
+            embeddings /= np.linalg.norm(embeddings, axis=1, keepdims=True) + 1e-12
             
+            # Rows stay ndarray views; they are persisted through the .npy shard, not as JSON lists
             for chunk, embedding in zip(chunks, embeddings):
-                chunk.embedding = embedding.tolist()
+                chunk.embedding = embedding
                 
         except Exception as e:
             logger.error(f"Failed to generate embeddings: {e}")
     
     async def _save_chunks(self, chunks: List[DocumentChunk]) -> str:
-        """Save document chunks to storage"""
+        """Save document chunks to storage, serializing and writing in a worker thread"""
+        return await asyncio.to_thread(self._save_chunks_sync, chunks)
+    
+    def _save_chunks_sync(self, chunks: List[DocumentChunk]) -> str:
+        """Write a document's chunk JSON and embedding shard; returns the document id"""
         if not chunks:
             return ""
         
         document_id = chunks[0].id.split('_')[0]
         
-        # Save chunks as JSON
+        # Text and metadata go to JSON; embeddings to a row-aligned float16 .npy shard
         chunks_file = self.embeddings_dir / f"{document_id}_chunks.json"
-        chunks_data = [asdict(chunk) for chunk in chunks]
+        embeddings_file = self.embeddings_dir / f"{document_id}_emb.npy"
+        chunks_data = [msgspec.structs.asdict(chunk) for chunk in chunks]
+        for chunk_data in chunks_data:
+            chunk_data["embedding"] = None
         
+        previous_bytes = self._shard_bytes(document_id) if self._storage_bytes is not None else 0
         try:
-            with open(chunks_file, 'w', encoding='utf-8') as f:
-                json.dump(chunks_data, f, indent=2, ensure_ascii=False)
+            if all(chunk.embedding is not None for chunk in chunks):
+                # Write then rename so a concurrent corpus load never reads a partial shard
+                tmp_file = embeddings_file.with_name(f"{embeddings_file.stem}.{os.getpid()}.tmp.npy")
+                np.save(tmp_file, np.stack([chunk.embedding for chunk in chunks]).astype(np.float16))
+                os.replace(tmp_file, embeddings_file)
+            elif embeddings_file.exists():
+                embeddings_file.unlink()
+            
+            # Chunk shards are machine-read only, so no indentation
+            chunks_file.write_bytes(orjson.dumps(chunks_data))
             
+            if self._storage_bytes is not None:
+                self._storage_bytes += self._shard_bytes(document_id) - previous_bytes
             logger.info(f"Saved {len(chunks)} chunks to {chunks_file}")
             return document_id
             
@@ -536,104 +950,300 @@ class DocumentProcessingService:
             logger.error(f"Failed to save chunks: {e}")
             return ""
     
-    async def search_documents(self, query: str, language: str = None, 
-                             category: str = None, max_results: int = 5) -> List[DocumentChunk]:
-        """Search documents using embeddings and keyword matching"""
-        all_chunks = []
+    def _load_chunk_shard(self, chunk_file: Path) -> List[DocumentChunk]:
+        """Decode one chunk file straight into DocumentChunk structs, cached by file mtime"""
+        mtime = chunk_file.stat().st_mtime_ns
+        cached = self._shard_cache.get(chunk_file.name)
+        if cached is not None and cached[0] == mtime:
+            return cached[1]
+        shard = _CHUNK_LIST_DECODER.decode(chunk_file.read_bytes())
+        for chunk in shard:
+            chunk.metadata.pop("normalized", None)  # internal flag stored by older versions
+        self._shard_cache[chunk_file.name] = (mtime, shard)
+        return shard
+    
+    def _load_search_corpus(self) -> ChunkStore:
+        """Load all chunk files into a ChunkStore with an L2-normalized (N, D) float32 embedding matrix
         
-        # Load all chunk files
-        for chunk_file in self.embeddings_dir.glob("*_chunks.json"):
+        The result is cached and only rebuilt when the set of shard files or their mtimes change.
+        Embeddings are copied in from each document's ``_emb.npy`` shard, or from inline
+        JSON lists in older chunk files. Chunks without an embedding get a zero row, flagged
+        False in ``has_embedding``. Language and category are dictionary-encoded for filtering.
+        """
+        with self._search_lock:
+            shard_files = sorted([*self.embeddings_dir.glob("*_chunks.json"), *self.embeddings_dir.glob("*_emb.npy")])
             try:
-                with open(chunk_file, 'r', encoding='utf-8') as f:
-                    chunks_data = json.load(f)
-                    for chunk_data in chunks_data:
-                        chunk = DocumentChunk(**chunk_data)
-                        all_chunks.append(chunk)
+                signature = tuple((f.name, f.stat().st_mtime_ns) for f in shard_files)
+            except OSError:
+                signature = None  # a file vanished mid-scan; load uncached
+        
+            if signature is not None and self._search_cache is not None and self._search_cache[0] == signature:
+                return self._search_cache[1]
+        
+            all_chunks = []
+            shard_embeddings = []  # (first row, (n, D) array) per document with an .npy shard
+            for chunk_file in shard_files:
+                if not chunk_file.name.endswith("_chunks.json"):
+                    continue
+                try:
+                    shard = self._load_chunk_shard(chunk_file)
+                    embeddings_file = chunk_file.with_name(chunk_file.name[:-len("_chunks.json")] + "_emb.npy")
+                    if embeddings_file.exists():
+                        embeddings = np.load(embeddings_file)
+                        if len(embeddings) == len(shard):
+                            shard_embeddings.append((len(all_chunks), embeddings))
+                    all_chunks.extend(shard)
+                except Exception as e:
+                    logger.error(f"Failed to load chunks from {chunk_file}: {e}")
+        
+            has_embedding = np.fromiter((chunk.embedding is not None and chunk.embedding.size > 0 for chunk in all_chunks), dtype=bool, count=len(all_chunks))
+            for start, embeddings in shard_embeddings:
+                has_embedding[start:start + len(embeddings)] = True
+        
+            matrix = None
+            if has_embedding.any():
+                if shard_embeddings:
+                    dim = shard_embeddings[0][1].shape[1]
+                else:
+                    dim = len(all_chunks[int(np.argmax(has_embedding))].embedding)
+                matrix = np.zeros((len(all_chunks), dim), dtype=np.float32)
+                for start, embeddings in shard_embeddings:
+                    matrix[start:start + len(embeddings)] = embeddings
+                for row, chunk in enumerate(all_chunks):
+                    if chunk.embedding is not None and chunk.embedding.size:
+                        matrix[row] = chunk.embedding
+                # Normalized once per corpus build, not per query: ingest stores unit rows, but the
+                # float16 round-trip and older files leave them only approximately unit length
+                matrix /= np.maximum(np.linalg.norm(matrix, axis=1, keepdims=True), 1e-12)
+        
+            language_names, language_codes = np.unique([chunk.language for chunk in all_chunks], return_inverse=True)
+            category_names, category_codes = np.unique([chunk.category for chunk in all_chunks], return_inverse=True)
+            corpus = ChunkStore(
+                chunks=all_chunks,
+                matrix=matrix,
+                has_embedding=has_embedding,
+                language_names=language_names.tolist(),
+                language_codes=language_codes.astype(np.int16),
+                category_names=category_names.tolist(),
+                category_codes=category_codes.astype(np.int16),
+                ann_index=self._load_ann_index(matrix, signature) if matrix is not None else None
+            )
+            self._result_cache.clear()  # cached results refer to the previous corpus
+            if signature is not None:
+                self._search_cache = (signature, corpus)
+            return corpus
+    
+    def _load_ann_index(self, matrix: np.ndarray, signature: Optional[tuple]) -> Any:
+        """FAISS index over the normalized matrix (inner product == cosine), or None without FAISS
+        
+        Persisted to ``index-<signature hash>.faiss`` and memory-mapped on reload, so a restart
+        over an unchanged corpus skips the HNSW build.
+        """
+        if not FAISS_AVAILABLE:
+            return None
+        
+        path = None
+        if signature is not None:
+            path = self.embeddings_dir / f"index-{fast_hexdigest(repr(signature))}.faiss"
+            if path.exists():
+                try:
+                    return faiss.read_index(str(path), faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY)
+                except Exception as e:
+                    logger.warning(f"Failed to read FAISS index {path}: {e}")
+        
+        try:
+            dim = matrix.shape[1]
+            if len(matrix) < FAISS_HNSW_MIN_VECTORS:
+                index = faiss.IndexFlatIP(dim)
+            else:
+                index = faiss.IndexHNSWFlat(dim, FAISS_HNSW_M, faiss.METRIC_INNER_PRODUCT)
+            index.add(np.ascontiguousarray(matrix, dtype=np.float32))
+        except Exception as e:
+            logger.error(f"Failed to build FAISS index: {e}")
+            return None
+        
+        if path is not None:
+            try:
+                tmp_path = path.with_name(f"{path.stem}.{os.getpid()}.tmp")
+                faiss.write_index(index, str(tmp_path))
+                os.replace(tmp_path, path)
+                for stale in self.embeddings_dir.glob("index-*.faiss"):
+                    if stale != path:
+                        stale.unlink(missing_ok=True)
             except Exception as e:
-                logger.error(f"Failed to load chunks from {chunk_file}: {e}")
+                logger.warning(f"Failed to persist FAISS index: {e}")
+        return index
+    
+    def _ann_search(self, ann_index: Any, query_vec: np.ndarray, allowed: Optional[np.ndarray],
+                    max_results: int) -> Optional[Tuple[np.ndarray, np.ndarray]]:
+        """(rows, scores) of the top matches from FAISS, post-filtered by the ``allowed`` row mask
+        
+        Returns None when a filtered search keeps fewer than ``max_results`` rows, so the caller
+        can fall back to an exact scan of the filtered rows.
+        """
+        total = ann_index.ntotal
+        k = min(total, max_results if allowed is None else max_results * FAISS_OVERSAMPLE)
+        scores, rows = ann_index.search(query_vec[None, :], k)
+        scores, rows = scores[0], rows[0].astype(np.intp)
+        
+        keep = rows >= 0
+        if allowed is not None:
+            keep &= allowed[np.maximum(rows, 0)]
+        rows, scores = rows[keep], scores[keep]
+        
+        if allowed is not None and rows.size < max_results and k < total:
+            return None
+        return rows, scores
+    
+    async def search_documents(self, query: str, language: str = None, 
+                             category: str = None, max_results: int = 5,
+                             query_embedding: Optional[np.ndarray] = None,
+                             similarity_threshold: Optional[float] = None,
+                             executor: Optional[Executor] = None) -> List[DocumentChunk]:
+        """Search documents using embeddings and keyword matching
+        
+        A precomputed ``query_embedding`` skips encoding the query again. Results scoring
+        below ``similarity_threshold`` (when given) are dropped. Corpus loading and scoring run
+        in ``executor`` (the default thread pool when None) to keep the event loop free.
+        """
+        return await asyncio.get_running_loop().run_in_executor(
+            executor, self._search_documents_sync, query, language, category, max_results,
+            query_embedding, similarity_threshold
+        )
+    
+    def _search_documents_sync(self, query: str, language: Optional[str], category: Optional[str],
+                               max_results: int, query_embedding: Optional[np.ndarray],
+                               similarity_threshold: Optional[float]) -> List[DocumentChunk]:
+        corpus = self._load_search_corpus()
+        all_chunks, matrix, has_embedding, ann_index = corpus.chunks, corpus.matrix, corpus.has_embedding, corpus.ann_index
         
-        if not all_chunks:
+        if not all_chunks or max_results <= 0:
             return []
         
-        # Filter by language and category
-        filtered_chunks = []
-        for chunk in all_chunks:
-            if language and chunk.language != language:
-                continue
-            if category and chunk.category != category:
-                continue
-            filtered_chunks.append(chunk)
+        # Filter by language and category on the dictionary-encoded columns
+        rows = corpus.filter_rows(language, category)
         
-        if not filtered_chunks:
+        if rows.size == 0:
             return []
         
-        # Embedding-based search
-        if self.embedding_model and any(chunk.embedding for chunk in filtered_chunks):
-            query_embedding = self.embedding_model.encode([query])[0]
+        # Embedding-based search: cosine is one matrix-vector product over pre-normalized rows
+        if self.embedding_model and matrix is not None and has_embedding[rows].any():
+            if query_embedding is None:
+                query_embedding = self.encode_query(query)
+            query_vec = np.asarray(query_embedding, dtype=np.float32)
+            query_vec = query_vec / max(float(np.linalg.norm(query_vec)), 1e-12)
             
-            for chunk in filtered_chunks:
-                if chunk.embedding:
-                    # Calculate cosine similarity
-                    chunk_embedding = np.array(chunk.embedding)
-                    similarity = np.dot(query_embedding, chunk_embedding) / (
-                        np.linalg.norm(query_embedding) * np.linalg.norm(chunk_embedding)
-                    )
-                    chunk.relevance_score = float(similarity)
-                else:
-                    chunk.relevance_score = 0.0
+            # A near-identical earlier query with the same parameters has the same answer
+            cache_params = (language, category, max_results, similarity_threshold)
+            cached = self._result_cache.get(query_vec, cache_params)
+            if cached is not None:
+                return cached
+            
+            ann_hits = None
+            if ann_index is not None:
+                allowed = None
+                if rows.size < len(all_chunks):
+                    allowed = np.zeros(len(all_chunks), dtype=bool)
+                    allowed[rows] = True
+                ann_hits = self._ann_search(ann_index, query_vec, allowed, max_results)
+            
+            if ann_hits is not None:
+                rows, scores = ann_hits
+            else:
+                scores = matrix[rows] @ query_vec  # chunks without embeddings have zero rows -> 0.0
         else:
+            query_vec = None
+            
             # Keyword-based fallback search
-            query_lower = query.lower()
-            for chunk in filtered_chunks:
-                content_lower = chunk.content.lower()
-                # Simple keyword matching score
-                query_words = query_lower.split()
-                matches = sum(1 for word in query_words if word in content_lower)
-                chunk.relevance_score = matches / len(query_words) if query_words else 0.0
-        
-        # Sort by relevance and return top results
-        sorted_chunks = sorted(filtered_chunks, key=lambda x: x.relevance_score, reverse=True)
-        return sorted_chunks[:max_results]
+            query_words = query.lower().split()
+            scores = np.array([
+                sum(1 for word in query_words if word in all_chunks[i].content.lower()) / len(query_words)
+                if query_words else 0.0
+                for i in rows
+            ], dtype=np.float32)
+        
+        if similarity_threshold is not None:
+            keep = scores >= similarity_threshold
+            rows, scores = rows[keep], scores[keep]
+        
+        # Top results without sorting every candidate
+        if rows.size > max_results:
+            top = np.argpartition(-scores, max_results - 1)[:max_results]
+        else:
+            top = np.arange(rows.size)
+        top = top[np.argsort(-scores[top], kind="stable")]
+        
+        # Scored copies keep the cached chunks untouched
+        results = [msgspec.structs.replace(all_chunks[rows[i]], relevance_score=float(scores[i])) for i in top]
+        if query_vec is not None:
+            self._result_cache.put(query_vec, cache_params, results)
+        return results
+    
+    def encode_query(self, query: str) -> Optional[np.ndarray]:
+        """Query embedding (None without a model), memoized by the normalized query text
+        
+        Case and whitespace only affect the cache key; the original text is what gets encoded.
+        """
+        if self.embedding_model is None:
+            return None
+        key = hashlib.blake2b(" ".join(query.lower().split()).encode(), digest_size=16).digest()
+        with self._search_lock:
+            embedding = self._query_embedding_cache.get(key)
+        if embedding is None:
+            with self._inference_mode():
+                embedding = self.embedding_model.encode([query], convert_to_numpy=True, normalize_embeddings=True)[0]
+            with self._search_lock:
+                self._query_embedding_cache[key] = embedding
+        return embedding
     
     def get_document_stats(self) -> Dict[str, Any]:
-        """Get comprehensive document processing statistics"""
-        stats = {
-            "total_documents": len(self.document_index["documents"]),
-            "total_chunks": 0,
-            "categories": {},
-            "languages": {},
-            "file_types": {},
-            "storage_mb": 0.0
-        }
+        """Get comprehensive document processing statistics
         
-        # Calculate statistics
-        for doc_id, doc_info in self.document_index["documents"].items():
-            stats["total_chunks"] += doc_info.get("total_chunks", 0)
-            
-            category = doc_info.get("category", "unknown")
-            stats["categories"][category] = stats["categories"].get(category, 0) + 1
-            
-            language = doc_info.get("language", "unknown")
-            stats["languages"][language] = stats["languages"].get(language, 0) + 1
-            
-            file_type = doc_info.get("file_type", "unknown")
-            stats["file_types"][file_type] = stats["file_types"].get(file_type, 0) + 1
+        Served from running totals; document shards are scanned from disk only on the first call
+        and then adjusted as they are written and deleted. Storage covers only files this service
+        owns (``{id}_chunks.json``, ``{id}_emb.npy`` and the FAISS index), not other users of
+        EMBEDDINGS_DIR such as the retrieval agent's document matrix.
+        """
+        if self._storage_bytes is None:
+            try:
+                self._storage_bytes = sum(
+                    file_path.stat().st_size
+                    for file_path in [*self.embeddings_dir.glob("*_chunks.json"), *self.embeddings_dir.glob("*_emb.npy")]
+                )
+            except Exception as e:
+                logger.warning(f"Failed to calculate storage usage: {e}")
         
-        # Calculate storage usage
-        try:
-            for file_path in self.embeddings_dir.glob("*.json"):
-                stats["storage_mb"] += file_path.stat().st_size / (1024 * 1024)
-        except Exception as e:
-            logger.warning(f"Failed to calculate storage usage: {e}")
+        # At most a couple of index files, rebuilt independently of uploads; stat them each call
+        index_bytes = 0
+        for index_file in self.embeddings_dir.glob("index-*.faiss"):
+            try:
+                index_bytes += index_file.stat().st_size
+            except FileNotFoundError:
+                pass
         
-        return stats
+        return {
+            "total_documents": len(self.document_index["documents"]),
+            "total_chunks": self._stats_chunks,
+            "categories": dict(self._stats_counters["categories"]),
+            "languages": dict(self._stats_counters["languages"]),
+            "file_types": dict(self._stats_counters["file_types"]),
+            "storage_mb": ((self._storage_bytes or 0) + index_bytes) / (1024 * 1024)
+        }
+
+# Global service instance, created on first use so importing this module stays cheap
+@lru_cache(maxsize=1)
+def get_document_processing_service() -> DocumentProcessingService:
+    return DocumentProcessingService()
 
-# Global service instance
-document_processing_service = DocumentProcessingService()
+async def close_document_processing_service() -> None:
+    """Flush the global service's pending index writes, if it was ever created, and stop PDF workers."""
+    if get_document_processing_service.cache_info().currsize:
+        await get_document_processing_service().aclose()
+    _shutdown_pdf_pool()
 
 # Convenience functions for backward compatibility
 async def process_pdf_file(file_content: bytes, filename: str, category: str = "general", language: str = "auto"):
-    return await document_processing_service.upload_and_process_file(file_content, filename, category, language)
+    return await get_document_processing_service().upload_and_process_file(file_content, filename, category, language)
 
 async def search_pdf_documents(query: str, language: str = None, category: str = None, max_results: int = 5):
-    return await document_processing_service.search_documents(query, language, category, max_results) 
\ No newline at end of file
+    return await get_document_processing_service().search_documents(query, language, category, max_results) 
\ No newline at end of file
@@ -0,0 +1,15 @@
+"""
+Fast non-cryptographic hashing for IDs, file tokens and cache keys
+"""
+
+from typing import Union
+
+# A hard requirement: document IDs derive from these digests, so every install must agree
+import xxhash
+
+
+def fast_hexdigest(data: Union[str, bytes]) -> str:
+    """Return a 64-bit xxh3 hex digest (16 characters) of the given data."""
+    if isinstance(data, str):
+        data = data.encode()
+    return xxhash.xxh3_64_hexdigest(data)
@@ -5,9 +5,10 @@ Simple logging configuration for RAG Chatbot
 import logging
 import sys
 from typing import Any, Dict
-import json
-from datetime import datetime
 import os
+import time
+
+import orjson
 
 # Simple config - no complex settings object
 DEBUG = os.getenv("DEBUG", "False").lower() == "true"
@@ -17,44 +18,48 @@ LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
 class JSONFormatter(logging.Formatter):
     """Custom JSON formatter for structured logging."""
     
+    # Optional per-record fields, copied when present on the record
+    _EXTRA_KEYS = ('request_id', 'user_id', 'method', 'url', 'status_code', 'duration_seconds')
+    
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # (whole second, formatted "YYYY-MM-DDTHH:MM:SS"), reused by every record in that second
+        self._timestamp_cache = (None, "")
+    
+    def _timestamp(self, created: float) -> str:
+        """ISO-8601 UTC timestamp with microseconds; the date/time part is formatted once per second"""
+        second = int(created)
+        cached_second, prefix = self._timestamp_cache
+        if second != cached_second:
+            prefix = time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime(second))
+            self._timestamp_cache = (second, prefix)
+        return f"{prefix}.{int((created - second) * 1_000_000):06d}Z"
+    
     def format(self, record: logging.LogRecord) -> str:
         """Format log record as JSON."""
         log_entry = {
-            "timestamp": datetime.utcnow().isoformat() + "Z",
+            "timestamp": self._timestamp(record.created),
             "level": record.levelname,
             "logger": record.name,
             "message": record.getMessage(),
         }
         
-        # Add extra fields
-        if hasattr(record, 'request_id'):
-            log_entry["request_id"] = record.request_id
-        
-        if hasattr(record, 'user_id'):
-            log_entry["user_id"] = record.user_id
-            
-        if hasattr(record, 'method'):
-            log_entry["method"] = record.method
-            
-        if hasattr(record, 'url'):
-            log_entry["url"] = record.url
-            
-        if hasattr(record, 'status_code'):
-            log_entry["status_code"] = record.status_code
-            
-        if hasattr(record, 'duration_seconds'):
-            log_entry["duration_seconds"] = record.duration_seconds
+        # Add extra fields (plain dict lookups instead of a hasattr per key)
+        attributes = record.__dict__
+        for key in self._EXTRA_KEYS:
+            if key in attributes:
+                log_entry[key] = attributes[key]
         
         # Add exception info
         if record.exc_info:
             log_entry["exception"] = self.formatException(record.exc_info)
         
         # Add any extra fields
-        extra_fields = getattr(record, 'extra', {})
+        extra_fields = attributes.get('extra')
         if extra_fields:
             log_entry.update(extra_fields)
         
-        return json.dumps(log_entry, ensure_ascii=False)
+        return orjson.dumps(log_entry, default=str, option=orjson.OPT_NON_STR_KEYS).decode()
 
 
 def setup_logging():
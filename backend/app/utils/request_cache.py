@@ -0,0 +1,32 @@
+"""
+Request-scoped memoization: a dict that lives for one HTTP request, so repeated lookups
+within the same request (e.g. language detection of the same message) are computed once
+"""
+
+from contextvars import ContextVar
+from typing import Any, Dict, Optional
+
+_request_cache: ContextVar[Optional[Dict[Any, Any]]] = ContextVar("request_cache", default=None)
+
+
+def get_request_cache() -> Optional[Dict[Any, Any]]:
+    """The current request's cache, or None outside a request."""
+    return _request_cache.get()
+
+
+class RequestCacheMiddleware:
+    """ASGI middleware giving each HTTP request a fresh, empty request cache."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        token = _request_cache.set({})
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            _request_cache.reset(token)
@@ -0,0 +1,11 @@
+"""
+Test setup: make the backend package (`app`) and the demo server importable
+"""
+
+import sys
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+for path in (ROOT, ROOT / "backend"):
+    if str(path) not in sys.path:
+        sys.path.insert(0, str(path))
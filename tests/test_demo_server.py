@@ -0,0 +1,91 @@
+"""
+Demo server: chat batcher lifecycle and ETag/304 handling
+"""
+
+import asyncio
+
+import orjson
+from fastapi.testclient import TestClient
+
+import working_demo_server as demo
+
+
+def _run_batcher(scenario):
+    async def main():
+        batcher = demo.ChatBatcher(max_batch_size=4, max_delay=5.0)  # long delay: batches stay half-built
+        batcher.start()
+        return await scenario(batcher)
+    return asyncio.run(main())
+
+
+def test_batcher_answers_pending_requests_when_stopped():
+    async def scenario(batcher):
+        messages = [f"question {i}" for i in range(6)] + ["مرحبا كيف حالك اليوم"]
+        tasks = [asyncio.create_task(batcher.process(demo.ChatRequest(message=message))) for message in messages]
+        await asyncio.sleep(0.05)  # first batch is collecting, the rest are queued
+        await batcher.stop()
+        return await asyncio.wait_for(asyncio.gather(*tasks), timeout=1)
+
+    bodies = [orjson.loads(body) for body in _run_batcher(scenario)]
+    assert len(bodies) == 7
+    assert [body["language"] for body in bodies] == ["en"] * 6 + ["ar"]
+
+
+def test_batcher_answers_inline_after_stop():
+    async def scenario(batcher):
+        await batcher.stop()
+        return await asyncio.wait_for(batcher.process(demo.ChatRequest(message="hello")), timeout=1)
+
+    assert orjson.loads(_run_batcher(scenario))["language"] == "en"
+
+
+def test_batch_with_a_failing_request_answers_the_others(monkeypatch):
+    compute_chat = demo._compute_chat
+
+    def failing_compute_chat(message, *args):
+        if message == "bad":
+            raise ValueError("bad message")
+        return compute_chat(message, *args)
+
+    monkeypatch.setattr(demo, "_compute_chat", failing_compute_chat)
+
+    async def scenario(batcher):
+        batcher.max_delay = 0.01
+        requests = [demo.ChatRequest(message=message) for message in ("first", "bad", "last")]
+        results = await asyncio.gather(*(batcher.process(request) for request in requests), return_exceptions=True)
+        await batcher.stop()
+        return results
+
+    first, bad, last = _run_batcher(scenario)
+    assert isinstance(bad, ValueError)
+    assert orjson.loads(first)["response"] and orjson.loads(last)["response"]
+
+
+def test_root_etag_and_304():
+    with TestClient(demo.app) as client:
+        response = client.get("/")
+        etag = response.headers["etag"]
+        assert response.status_code == 200 and response.json()
+
+        not_modified = client.get("/", headers={"If-None-Match": etag})
+        assert not_modified.status_code == 304
+        assert not_modified.content == b""
+        assert not_modified.headers["etag"] == etag
+
+        assert client.get("/", headers={"If-None-Match": f'"stale", {etag}'}).status_code == 304
+        assert client.get("/", headers={"If-None-Match": "*"}).status_code == 304
+        assert client.get("/", headers={"If-None-Match": '"stale"'}).status_code == 200
+
+
+def test_document_list_etag_is_rebuilt_after_delete():
+    with TestClient(demo.app) as client:
+        response = client.get("/api/v1/documents")
+        etag = response.headers["etag"]
+        assert client.get("/api/v1/documents", headers={"If-None-Match": etag}).status_code == 304
+
+        assert client.delete("/api/v1/documents/doc_1").status_code == 200
+        assert demo._docs_cache_bytes is None
+
+        refreshed = client.get("/api/v1/documents")
+        assert refreshed.status_code == 200
+        assert refreshed.headers["etag"] == demo._etag(refreshed.content)
@@ -0,0 +1,111 @@
+"""
+Document service: ndjson index log replay and compaction, and sentence-window chunking
+"""
+
+import asyncio
+
+import orjson
+import pytest
+
+from app.services import pdf_processing_service
+from app.services.pdf_processing_service import DocumentProcessingService
+
+
+def _info(filename):
+    return {"filename": filename, "file_type": ".txt", "category": "general", "language": "en",
+            "total_chunks": 1, "created_at": "2024-01-01T00:00:00"}
+
+
+def _put(service, document_id, filename):
+    service.document_index["documents"][document_id] = _info(filename)
+    service._log_document_index("put", document_id, _info(filename))
+
+
+@pytest.fixture
+def service(tmp_path):
+    return DocumentProcessingService(data_dir=str(tmp_path))
+
+
+def test_index_log_replays_puts_and_deletes(service, tmp_path):
+    _put(service, "a", "a.txt")
+    _put(service, "b", "b.txt")
+    _put(service, "a", "renamed.txt")
+    service.document_index["documents"].pop("b")
+    service._log_document_index("delete", "b")
+
+    reloaded = DocumentProcessingService(data_dir=str(tmp_path))
+    assert reloaded.document_index["documents"] == {"a": _info("renamed.txt")}
+    assert not reloaded.index_file.exists()  # nothing compacted yet
+
+
+def test_index_log_skips_a_torn_final_line(service, tmp_path):
+    _put(service, "a", "a.txt")
+    with open(service.index_log_file, "ab") as f:
+        f.write(b'{"op": "put", "id": "b", "in')
+
+    reloaded = DocumentProcessingService(data_dir=str(tmp_path))
+    assert list(reloaded.document_index["documents"]) == ["a"]
+
+
+def test_index_log_compacts_into_snapshot(service, tmp_path, monkeypatch):
+    monkeypatch.setattr(pdf_processing_service, "DOCUMENT_INDEX_COMPACT_EVERY", 3)
+    for document_id in ("a", "b", "c"):
+        _put(service, document_id, f"{document_id}.txt")
+
+    assert service.index_log_file.read_bytes() == b""
+    snapshot = orjson.loads(service.index_file.read_bytes())
+    assert sorted(snapshot["documents"]) == ["a", "b", "c"]
+
+    _put(service, "d", "d.txt")
+    reloaded = DocumentProcessingService(data_dir=str(tmp_path))
+    assert sorted(reloaded.document_index["documents"]) == ["a", "b", "c", "d"]
+
+
+def test_index_changes_inside_the_loop_are_flushed_once(service, monkeypatch):
+    monkeypatch.setattr(pdf_processing_service, "DOCUMENT_INDEX_FLUSH_DELAY", 0.01)
+
+    async def upload_burst():
+        for document_id in ("a", "b", "c"):
+            _put(service, document_id, f"{document_id}.txt")
+        assert not service.index_log_file.exists()  # debounced, nothing written yet
+        await service.aclose()
+
+    asyncio.run(upload_burst())
+    lines = service.index_log_file.read_bytes().splitlines()
+    assert [orjson.loads(line)["id"] for line in lines] == ["a", "b", "c"]
+
+
+def _chunk(service, text):
+    return asyncio.run(service._create_text_chunks(text, "notes.txt", "text", "general", "en"))
+
+
+def test_chunks_are_sentence_windows_within_the_size_limit(service):
+    sentences = [f"Sentence number {i} talks about topic {i % 7} in some detail" for i in range(120)]
+    chunks = _chunk(service, ". ".join(sentences) + ".")
+
+    assert len(chunks) > 1
+    assert [chunk.chunk_index for chunk in chunks] == list(range(len(chunks)))
+    assert len({chunk.id for chunk in chunks}) == len(chunks)
+    for chunk in chunks:
+        assert len(chunk.content) <= 1000
+        assert chunk.metadata["char_count"] == len(chunk.content)
+        assert chunk.metadata["word_count"] == len(chunk.content.split())
+
+    # Every sentence appears, in order, and consecutive windows share their boundary sentences
+    assert chunks[0].content.startswith(sentences[0])
+    assert chunks[-1].content.endswith(sentences[-1])
+    for previous, current in zip(chunks, chunks[1:]):
+        first_sentence = current.content.split(" Sentence number")[0]
+        assert first_sentence in previous.content
+
+
+def test_oversized_sentence_becomes_its_own_chunk(service):
+    long_sentence = "word " * 400
+    chunks = _chunk(service, f"Short intro. {long_sentence}. Short outro.")
+
+    assert [chunk.content for chunk in chunks][1] == long_sentence.strip()
+    assert chunks[-1].content.endswith("Short outro")
+
+
+def test_empty_text_has_no_chunks(service):
+    assert _chunk(service, " .!? ") == []
@@ -0,0 +1,49 @@
+"""
+Retrieval result deduplication
+"""
+
+from app.agents.retrieval import DocumentChunk, _dedupe_documents
+
+
+def _doc(doc_id, content, source="services.json", **metadata):
+    return DocumentChunk(id=doc_id, content=content, source=source, category="services",
+                         language="en", metadata=metadata)
+
+
+def test_identical_content_is_dropped():
+    docs = [_doc("a", "Cloud hosting"), _doc("b", "Cloud hosting", source="other.json")]
+
+    assert [doc.id for doc in _dedupe_documents(docs)] == ["a"]
+
+
+def test_json_entries_with_the_same_section_are_dropped():
+    docs = [
+        _doc("a", "Cloud hosting plans", section="pricing"),
+        _doc("b", "Updated cloud hosting plans", section="pricing"),
+        _doc("c", "Support hours", section="support"),
+    ]
+
+    assert [doc.id for doc in _dedupe_documents(docs)] == ["a", "c"]
+
+
+def test_file_chunks_sharing_a_heading_are_kept():
+    # Markdown chunks repeat their section heading; only content or chunk id makes them duplicates
+    docs = [
+        _doc("md_0", "First part of the overview", source="guide.md", source_type="pdf", section_title="Overview"),
+        _doc("md_1", "Second part of the overview", source="guide.md", source_type="pdf", section_title="Overview"),
+        _doc("md_1", "Second part of the overview, again", source="guide.md", source_type="pdf", section_title="Overview"),
+    ]
+
+    assert [doc.id for doc in _dedupe_documents(docs)] == ["md_0", "md_1"]
+
+
+def test_seen_keys_carry_across_calls():
+    seen = set()
+    first = _dedupe_documents([_doc("a", "Cloud hosting", section="pricing")], seen)
+    second = _dedupe_documents([
+        _doc("b", "Cloud hosting", source="guide.pdf", source_type="pdf"),
+        _doc("c", "Support hours", source="guide.pdf", source_type="pdf"),
+    ], seen)
+
+    assert [doc.id for doc in first] == ["a"]
+    assert [doc.id for doc in second] == ["c"]
@@ -0,0 +1,121 @@
+"""
+Scoring kernels: bitset Jaccard, BM25 and int8/1-bit quantized codes against plain references
+"""
+
+import math
+
+import numpy as np
+import pytest
+
+from app.agents import scoring
+from app.agents.scoring import BM25Index, QuantizedMatrix, TokenBitsets
+
+TEXTS = [
+    "Company services include cloud hosting and support",
+    "Our support team answers within one business day",
+    "cloud cloud migration services for enterprise customers",
+    "Arabic and French documents are supported",
+    "",
+]
+
+
+def _jaccard(query: set, text: str) -> float:
+    tokens = set(text.lower().split())
+    union = len(query | tokens)
+    return len(query & tokens) / union if union else 0.0
+
+
+def test_token_bitsets_jaccard_matches_set_reference():
+    bitsets = TokenBitsets.build(TEXTS)
+    query = {"cloud", "support", "unknown"}
+
+    expected = [_jaccard(query, text) for text in TEXTS]
+    np.testing.assert_allclose(bitsets.jaccard(query), expected, rtol=1e-6)
+
+
+def test_token_bitsets_empty_query_scores_zero():
+    bitsets = TokenBitsets.build(TEXTS)
+    assert not bitsets.jaccard([]).any()
+
+
+def test_token_bitsets_large_vocabulary_returns_none(monkeypatch):
+    monkeypatch.setattr(scoring, "MAX_BITSET_VOCAB", 3)
+    assert TokenBitsets.build(["one two three four"]) is None
+
+
+def test_token_bitsets_spans_several_words():
+    # More than 64 distinct tokens, so documents set bits beyond the first uint64 word
+    texts = [" ".join(f"w{i}" for i in range(start, start + 70)) for start in (0, 50)]
+    bitsets = TokenBitsets.build(texts)
+    query = {f"w{i}" for i in range(60, 80)}
+
+    expected = [_jaccard(query, text) for text in texts]
+    np.testing.assert_allclose(bitsets.jaccard(query), expected, rtol=1e-6)
+
+
+def _bm25_reference(texts, query, k1=1.5, b=0.75):
+    docs = [text.lower().split() for text in texts]
+    avg_length = sum(len(doc) for doc in docs) / len(docs)
+    scores = []
+    for doc in docs:
+        score = 0.0
+        for term in set(query):
+            tf = doc.count(term)
+            if not tf:
+                continue
+            df = sum(term in other for other in docs)
+            idf = math.log(1 + (len(docs) - df + 0.5) / (df + 0.5))
+            score += idf * tf * (k1 + 1) / (tf + k1 * (1 - b + b * len(doc) / avg_length))
+        scores.append(score)
+    return scores
+
+
+def test_bm25_scores_match_reference():
+    index = BM25Index.build(TEXTS)
+    query = ["cloud", "services", "support", "cloud"]
+
+    np.testing.assert_allclose(index.scores(query), _bm25_reference(TEXTS, query), rtol=1e-5)
+
+
+def test_bm25_candidates():
+    index = BM25Index.build(TEXTS)
+
+    assert index.candidates(["nothing", "matches"], limit=3) is None
+
+    rows = index.candidates(["cloud", "support"], limit=2)
+    scores = index.scores(["cloud", "support"])
+    assert sorted(rows.tolist()) == sorted(np.argsort(-scores)[:2].tolist())
+
+
+@pytest.fixture
+def unit_matrix():
+    rng = np.random.default_rng(0)
+    matrix = rng.standard_normal((500, 64)).astype(np.float32)
+    return matrix / np.linalg.norm(matrix, axis=1, keepdims=True)
+
+
+def test_quantized_dot_approximates_float_dot(unit_matrix):
+    quantized = QuantizedMatrix.fit(unit_matrix)
+    query = unit_matrix[7]
+    rows = np.arange(len(unit_matrix))
+
+    approx = quantized.dot(query, rows)
+    np.testing.assert_allclose(approx, unit_matrix @ query, atol=0.05)
+    assert int(np.argmax(approx)) == 7
+
+
+def test_quantized_dot_subset_of_rows(unit_matrix):
+    quantized = QuantizedMatrix.fit(unit_matrix)
+    query = unit_matrix[3]
+    rows = np.array([3, 10, 499])
+
+    np.testing.assert_allclose(quantized.dot(query, rows), unit_matrix[rows] @ query, atol=0.05)
+
+
+def test_quantized_candidates_keep_the_nearest_row(unit_matrix):
+    quantized = QuantizedMatrix.fit(unit_matrix)
+
+    candidates = quantized.candidates(unit_matrix[42], limit=50)
+    assert len(candidates) == 50
+    assert 42 in candidates
+    assert len(quantized.candidates(unit_matrix[42], limit=1000)) == len(unit_matrix)
@@ -4,31 +4,101 @@ Simple RAG Chatbot Demo Server
 A minimal FastAPI server to test the RAG chatbot functionality
 """
 
-from fastapi import FastAPI, UploadFile, File, HTTPException
-from fastapi.middleware.cors import CORSMiddleware
+from fastapi import FastAPI, UploadFile, File, HTTPException, Request
+from fastapi.responses import ORJSONResponse, Response
 from pydantic import BaseModel
-from typing import List, Optional
+from typing import Any, Dict, List, Optional, Tuple
+from contextlib import asynccontextmanager
+from functools import lru_cache
+import asyncio
+import hashlib
+import numpy as np
 import uvicorn
-import json
-from datetime import datetime
+import msgspec
+import orjson
+import os
+import re
+import time
+from datetime import datetime, timezone
+
+# Async file writes for persisted uploads (optional dependency)
+try:
+    import aiofiles
+    AIOFILES_AVAILABLE = True
+except ImportError:
+    AIOFILES_AVAILABLE = False
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Run the chat batcher for the lifetime of the server"""
+    _chat_batcher.start()
+    yield
+    await _chat_batcher.stop()
 
 app = FastAPI(
     title="RAG Chatbot Demo",
     description="Simple demo server for testing RAG chatbot functionality",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan,
+    default_response_class=ORJSONResponse
 )
 
+class AllowAllCORSMiddleware:
+    """ASGI CORS for a demo that allows every origin, method and header. Answers preflights
+    directly (204); like Starlette's CORSMiddleware, the origin is echoed with credentials
+    allowed only when the request carries credentials, otherwise ``*`` is sent."""
+    
+    def __init__(self, app):
+        self.app = app
+    
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        
+        request_headers = dict(scope["headers"])
+        origin = request_headers.get(b"origin")
+        if origin is None:
+            await self.app(scope, receive, send)
+            return
+        
+        # Preflight: answer without reaching the app. It never carries cookies itself, but the
+        # request it clears may, so the origin is echoed with credentials allowed
+        if scope["method"] == "OPTIONS" and b"access-control-request-method" in request_headers:
+            preflight_headers = [
+                (b"access-control-allow-origin", origin),
+                (b"access-control-allow-credentials", b"true"),
+                (b"access-control-allow-methods", request_headers[b"access-control-request-method"]),
+                (b"access-control-max-age", b"600"),
+                (b"vary", b"Origin"),
+            ]
+            if b"access-control-request-headers" in request_headers:
+                preflight_headers.append((b"access-control-allow-headers", request_headers[b"access-control-request-headers"]))
+            await send({"type": "http.response.start", "status": 204, "headers": preflight_headers})
+            await send({"type": "http.response.body", "body": b""})
+            return
+        
+        if b"cookie" in request_headers or b"authorization" in request_headers:
+            cors_headers = [
+                (b"access-control-allow-origin", origin),
+                (b"access-control-allow-credentials", b"true"),
+                (b"vary", b"Origin"),
+            ]
+        else:
+            cors_headers = [(b"access-control-allow-origin", b"*")]
+        
+        async def send_with_cors(message):
+            if message["type"] == "http.response.start":
+                message["headers"] = [*message.get("headers", []), *cors_headers]
+            await send(message)
+        
+        await self.app(scope, receive, send_with_cors)
+
 # CORS middleware
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=["*"],
-    allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
-)
+app.add_middleware(AllowAllCORSMiddleware)
 
 # Models
-class ChatRequest(BaseModel):
+class ChatRequest(msgspec.Struct):
     message: str
     include_context: bool = True
     max_context: int = 3
@@ -40,6 +110,108 @@ class ChatResponse(BaseModel):
     context_used: bool
     confidence: float
 
+_CHAT_REQUEST_DECODER = msgspec.json.Decoder(ChatRequest)
+_CHAT_REQUEST_SCHEMA = msgspec.json.schema_components([ChatRequest])[1]["ChatRequest"]
+
+# Any Arabic-block character marks a message as Arabic
+_AR_RE = re.compile(r'[\u0600-\u06FF]')
+
+# Batches at least this large detect Arabic with one NumPy pass instead of a regex per message
+ARABIC_VECTOR_MIN_BATCH = 8
+
+
+# Reply text per detected language; the message is substituted for %s
+_RESPONSE_TEMPLATES = {
+    "ar": "أفهم سؤالك: '%s'. يمكنني مساعدتك بالخدمات الرقمية والتدريب.",
+    "en": "I understand your question: '%s'. I can help with digital services and training."
+}
+
+# Mock source attached to replies that match _CTX_RE
+_RELEVANT_DOC = {
+    "filename": "services.json",
+    "type": "json",
+    "relevance": 0.85,
+    "content_preview": "Digital transformation services..."
+}
+
+# Keyword -> mock sources it pulls into a reply; one regex alternation finds every
+# keyword occurrence (anywhere, any case) in a single scan of the message
+_KW2DOC = {
+    "service": (_RELEVANT_DOC,),
+    "training": (_RELEVANT_DOC,),
+    "help": (_RELEVANT_DOC,),
+}
+_CTX_RE = re.compile("|".join(map(re.escape, _KW2DOC)), re.IGNORECASE)
+
+# Upload extensions accepted by the demo
+_ALLOWED_TYPES = frozenset({'.pdf', '.md', '.markdown', '.txt', '.json'})
+
+# Chat requests arriving within CHAT_BATCH_DELAY seconds are answered as one batch
+CHAT_BATCH_SIZE = int(os.getenv("DEMO_CHAT_BATCH_SIZE", "32"))
+CHAT_BATCH_DELAY = float(os.getenv("DEMO_CHAT_BATCH_DELAY", "0.01"))
+
+# Bind address and server processes for `python working_demo_server.py`. One process by default:
+# documents, the chat reply cache and /api/v1/cache/clear are all per-process state
+DEMO_HOST = os.getenv("DEMO_HOST", "0.0.0.0")
+DEMO_PORT = int(os.getenv("DEMO_PORT", "8001"))
+DEMO_WORKERS = max(1, int(os.getenv("DEMO_WORKERS", "1")))
+
+# Uploads are consumed in pieces of this size rather than read whole
+_UPLOAD_CHUNK_SIZE = 1 << 20
+
+# When set, uploads are written here (the demo otherwise discards them)
+DEMO_UPLOAD_DIR = os.getenv("DEMO_UPLOAD_DIR", "")
+
+class BatchItem(BaseModel):
+    id: str
+    url: str
+    method: str = "POST"
+    body: Dict[str, Any] = {}
+
+class BatchRequest(BaseModel):
+    requests: List[BatchItem]
+
+# Static response bodies, serialized once; /health only splices in its timestamp
+_ROOT_BYTES = orjson.dumps({
+    "message": "🤖 RAG Chatbot Demo Server",
+    "version": "1.0.0",
+    "endpoints": {
+        "chat": "/api/v1/chat",
+        "upload": "/api/v1/upload",
+        "documents": "/api/v1/documents",
+        "health": "/api/v1/health"
+    }
+})
+_HEALTH_PREFIX = orjson.dumps({
+    "status": "healthy",
+    "service": "RAG Chatbot Demo",
+    "version": "1.0.0",
+    "features": {
+        "rag_chat": True,
+        "document_upload": True,
+        "language_detection": True,
+        "supported_formats": [".pdf", ".md", ".txt", ".json"],
+        "supported_languages": ["en", "ar", "fr"]
+    }
+})[:-1] + b',"timestamp":"'
+
+# (whole second, ISO-8601 UTC string) shared by every request within that second
+_ts_cache = (0, "")
+
+def _iso_now() -> str:
+    """Current UTC time at one-second resolution, formatted once per second"""
+    global _ts_cache
+    second = int(time.time())
+    if second != _ts_cache[0]:
+        _ts_cache = (second, datetime.fromtimestamp(second, timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ"))
+    return _ts_cache[1]
+
+def _etag(body: bytes) -> str:
+    """Strong ETag for a response body"""
+    return '"%s"' % hashlib.blake2b(body, digest_size=8).hexdigest()
+
+_ROOT_ETAG = _etag(_ROOT_BYTES)
+
 # Mock data
 mock_documents = [
     {
@@ -56,121 +228,283 @@ mock_documents = [
     }
 ]
 
+# Serialized /documents body and its ETag, rebuilt after an upload or delete
+_docs_cache_bytes: Optional[bytes] = None
+_docs_etag = ""
+
+def _json_bytes_response(request: Request, body: bytes, etag: str) -> Response:
+    """Serve pre-encoded JSON, or an empty 304 when the client already holds this ETag"""
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match and (if_none_match.strip() == "*" or etag in (tag.strip() for tag in if_none_match.split(","))):
+        return Response(status_code=304, headers={"etag": etag})
+    return Response(body, media_type="application/json", headers={"etag": etag})
+
 @app.get("/")
-async def root():
+async def root(request: Request):
     """Welcome message"""
-    return {
-        "message": "🤖 RAG Chatbot Demo Server",
-        "version": "1.0.0",
-        "endpoints": {
-            "chat": "/api/v1/chat",
-            "upload": "/api/v1/upload",
-            "documents": "/api/v1/documents",
-            "health": "/api/v1/health"
-        }
-    }
+    return _json_bytes_response(request, _ROOT_BYTES, _ROOT_ETAG)
 
-@app.post("/api/v1/chat", response_model=ChatResponse)
-async def chat(request: ChatRequest):
-    """Simple chat endpoint with mock responses"""
+def _detect_languages(messages: List[str]) -> List[str]:
+    """"ar" for messages containing an Arabic-block character, else "en"
     
-    # Auto-detect language
-    language = "ar" if any('\u0600' <= char <= '\u06FF' for char in request.message) else "en"
+    Large batches are scanned as one UTF-32 codepoint array: each message is followed by a
+    NUL sentinel so every segment is non-empty, and np.add.reduceat counts Arabic
+    codepoints per segment. Lone surrogates (from ``\\ud800``-style JSON escapes) pass through
+    as their own codepoints, so one such message can't fail the whole batch.
+    """
+    if len(messages) < ARABIC_VECTOR_MIN_BATCH:
+        return ["ar" if _AR_RE.search(message) else "en" for message in messages]
     
-    # Mock context search
-    relevant_docs = []
-    if request.include_context and any(word in request.message.lower() for word in ["service", "training", "help"]):
-        relevant_docs = [
-            {
-                "filename": "services.json",
-                "type": "json",
-                "relevance": 0.85,
-                "content_preview": "Digital transformation services..."
-            }
-        ]
+    codepoints = np.frombuffer("".join(message + "\0" for message in messages).encode("utf-32-le", "surrogatepass"), dtype=np.uint32)
+    offsets = np.cumsum([0] + [len(message) + 1 for message in messages[:-1]])
+    is_arabic = (codepoints >= 0x600) & (codepoints <= 0x6FF)
+    return ["ar" if found else "en" for found in np.add.reduceat(is_arabic, offsets) > 0]
+
+@lru_cache(maxsize=1024)
+def _compute_chat(message: str, include_context: bool, max_context: int, language: str) -> bytes:
+    """Serialized ChatResponse body for a detected language, memoized as immutable bytes"""
+    
+    # Mock context search: sources of every matched keyword, first match first, deduplicated
+    relevant_docs = ()
+    if include_context and max_context > 0:
+        hits = {}
+        for match in _CTX_RE.finditer(message):
+            for doc in _KW2DOC[match.group().lower()]:
+                hits.setdefault(doc["filename"], doc)
+            if len(hits) >= max_context:
+                break
+        relevant_docs = tuple(hits.values())[:max_context]
     
     # Generate response based on language
-    if language == "ar":
-        response_text = f"أفهم سؤالك: '{request.message}'. يمكنني مساعدتك بالخدمات الرقمية والتدريب."
-    else:
-        response_text = f"I understand your question: '{request.message}'. I can help with digital services and training."
+    response_text = _RESPONSE_TEMPLATES[language] % message
+    
+    return orjson.dumps({
+        "response": response_text,
+        "language": language,
+        "sources": relevant_docs,
+        "context_used": bool(relevant_docs),
+        "confidence": 0.8
+    })
+
+def _chat_batch(requests: List[ChatRequest]) -> List[bytes]:
+    """Answer a batch of chat requests in one pass, as serialized ChatResponse bodies"""
+    languages = _detect_languages([request.message for request in requests])
+    return [
+        _compute_chat(request.message, request.include_context, request.max_context, language)
+        for request, language in zip(requests, languages)
+    ]
+
+class ChatBatcher:
+    """Coalesces concurrent chat requests: the first queued request waits at most
+    ``max_delay`` seconds for others, then up to ``max_batch_size`` are answered together."""
+    
+    def __init__(self, max_batch_size: int, max_delay: float):
+        self.max_batch_size = max_batch_size
+        self.max_delay = max_delay
+        self._queue: Optional[asyncio.Queue] = None
+        self._worker: Optional[asyncio.Task] = None
+        self._batch: List[Tuple[ChatRequest, asyncio.Future]] = []  # being collected or answered
+    
+    def start(self):
+        self._queue = asyncio.Queue()
+        self._worker = asyncio.create_task(self._run())
+    
+    async def stop(self):
+        if self._worker is not None:
+            self._worker.cancel()
+            try:
+                await self._worker
+            except asyncio.CancelledError:
+                pass
+            self._worker = None
+            
+            # Answer whatever was queued or half-batched inline so no caller is left waiting
+            pending = self._batch
+            self._batch = []
+            while not self._queue.empty():
+                pending.append(self._queue.get_nowait())
+            self._answer([item for item in pending if not item[1].done()])
     
-    return ChatResponse(
-        response=response_text,
-        language=language,
-        sources=relevant_docs,
-        context_used=len(relevant_docs) > 0,
-        confidence=0.8
-    )
+    async def process(self, request: ChatRequest) -> bytes:
+        if self._worker is None:
+            return _chat_batch([request])[0]  # not started (e.g. no lifespan): answer inline
+        future = asyncio.get_running_loop().create_future()
+        self._queue.put_nowait((request, future))
+        return await future
+    
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = self._batch = [await self._queue.get()]
+            deadline = loop.time() + self.max_delay
+            while len(batch) < self.max_batch_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+            
+            self._answer(batch)
+            self._batch = []
+    
+    @staticmethod
+    def _answer(batch: List[Tuple[ChatRequest, asyncio.Future]]):
+        if not batch:
+            return
+        try:
+            responses = _chat_batch([request for request, _ in batch])
+        except Exception:
+            # One bad request must not fail the others: answer each on its own
+            for request, future in batch:
+                if future.done():
+                    continue
+                try:
+                    future.set_result(_chat_batch([request])[0])
+                except Exception as e:
+                    future.set_exception(e)
+            return
+        for (_, future), response in zip(batch, responses):
+            if not future.done():  # the client may have disconnected
+                future.set_result(response)
+
+_chat_batcher = ChatBatcher(CHAT_BATCH_SIZE, CHAT_BATCH_DELAY)
+
+# Chat bodies are decoded by msgspec and served as cached bytes; ChatResponse only documents the schema
+@app.post(
+    "/api/v1/chat",
+    responses={200: {"model": ChatResponse}},
+    openapi_extra={"requestBody": {"required": True, "content": {"application/json": {"schema": _CHAT_REQUEST_SCHEMA}}}}
+)
+async def chat(request: Request):
+    """Simple chat endpoint with mock responses"""
+    try:
+        chat_request = _CHAT_REQUEST_DECODER.decode(await request.body())
+    except msgspec.DecodeError as e:  # includes ValidationError
+        raise HTTPException(422, str(e))
+    return Response(await _chat_batcher.process(chat_request), media_type="application/json")
+
+async def _run_batch_item(item: BatchItem) -> Dict[str, Any]:
+    """Dispatch one sub-request of /api/v1/batch to its handler"""
+    route = (item.method.upper(), item.url)
+    try:
+        if route == ("POST", "/api/v1/chat"):
+            body = orjson.loads(await _chat_batcher.process(msgspec.convert(item.body, ChatRequest)))
+        elif route == ("GET", "/api/v1/documents"):
+            body = orjson.loads(_documents_bytes())
+        elif route == ("GET", "/api/v1/health"):
+            body = await health_check()
+        else:
+            return {"id": item.id, "status": 404, "body": {"detail": f"Unsupported batch route: {item.method} {item.url}"}}
+    except msgspec.ValidationError as e:
+        return {"id": item.id, "status": 422, "body": {"detail": str(e)}}
+    if isinstance(body, Response):
+        body = orjson.loads(body.body)  # handlers serving pre-encoded bytes
+    return {"id": item.id, "status": 200, "body": body}
+
+@app.post("/api/v1/batch")
+async def batch(request: BatchRequest):
+    """Run several API calls in one round-trip; responses keep each sub-request's id"""
+    return {"responses": await asyncio.gather(*(_run_batch_item(item) for item in request.requests))}
+
+@app.post("/api/v1/cache/clear")
+async def clear_cache():
+    """Drop memoized chat replies (in this worker process only)"""
+    _compute_chat.cache_clear()
+    return {"success": True, "message": "Chat cache cleared"}
+
+async def _iter_chunks(file: UploadFile, size: int):
+    """Yield an upload's content in pieces of at most ``size`` bytes"""
+    while chunk := await file.read(size):
+        yield chunk
 
 @app.post("/api/v1/upload")
 async def upload_document(file: UploadFile = File(...), category: str = "general"):
     """Mock document upload"""
     
     # Validate file type
-    allowed_types = {'.pdf', '.md', '.markdown', '.txt', '.json'}
-    file_ext = file.filename.split('.')[-1].lower()
+    ext = os.path.splitext(file.filename)[1].lower()
     
-    if f'.{file_ext}' not in allowed_types:
-        raise HTTPException(400, f"Unsupported file type: .{file_ext}")
+    if ext not in _ALLOWED_TYPES:
+        raise HTTPException(400, f"Unsupported file type: {ext}")
     
-    # Mock processing
-    content = await file.read()
+    global _docs_cache_bytes
+    _docs_cache_bytes = None
+    
+    # Mock processing: consume the upload in bounded chunks, persisting it if configured
+    total = 0
+    if DEMO_UPLOAD_DIR and AIOFILES_AVAILABLE:
+        os.makedirs(DEMO_UPLOAD_DIR, exist_ok=True)
+        async with aiofiles.open(os.path.join(DEMO_UPLOAD_DIR, os.path.basename(file.filename)), "wb") as f:
+            async for chunk in _iter_chunks(file, _UPLOAD_CHUNK_SIZE):
+                await f.write(chunk)
+                total += len(chunk)
+    else:
+        async for chunk in _iter_chunks(file, _UPLOAD_CHUNK_SIZE):
+            total += len(chunk)
     
     return {
         "success": True,
         "document_id": f"doc_{len(mock_documents) + 1}",
         "filename": file.filename,
-        "file_type": file_ext,
+        "file_type": ext[1:],
         "chunks": 5,
-        "language": "en"
+        "language": "en",
+        "size_bytes": total
     }
 
+def _documents_bytes() -> bytes:
+    """Serialized mock document list, built on first use after each invalidation"""
+    global _docs_cache_bytes, _docs_etag
+    if _docs_cache_bytes is None:
+        uploaded_at = _iso_now()
+        _docs_cache_bytes = orjson.dumps([
+            {
+                "id": doc["id"],
+                "filename": doc["filename"],
+                "file_type": os.path.splitext(doc["filename"])[1][1:],
+                "language": doc["language"],
+                "chunks": 5,
+                "uploaded_at": uploaded_at
+            }
+            for doc in mock_documents
+        ])
+        _docs_etag = _etag(_docs_cache_bytes)
+    return _docs_cache_bytes
+
 @app.get("/api/v1/documents")
-async def list_documents():
+async def list_documents(request: Request):
     """List mock documents"""
-    return [
-        {
-            "id": doc["id"],
-            "filename": doc["filename"],
-            "file_type": doc["filename"].split('.')[-1],
-            "language": doc["language"],
-            "chunks": 5,
-            "uploaded_at": datetime.now().isoformat()
-        }
-        for doc in mock_documents
-    ]
+    body = _documents_bytes()
+    return _json_bytes_response(request, body, _docs_etag)
 
 @app.delete("/api/v1/documents/{document_id}")
 async def delete_document(document_id: str):
     """Mock document deletion"""
+    global _docs_cache_bytes
+    _docs_cache_bytes = None
     return {"success": True, "message": f"Document {document_id} deleted"}
 
 @app.get("/api/v1/health")
 async def health_check():
     """Health check"""
-    return {
-        "status": "healthy",
-        "service": "RAG Chatbot Demo",
-        "version": "1.0.0",
-        "features": {
-            "rag_chat": True,
-            "document_upload": True,
-            "language_detection": True,
-            "supported_formats": [".pdf", ".md", ".txt", ".json"],
-            "supported_languages": ["en", "ar", "fr"]
-        },
-        "timestamp": datetime.now().isoformat()
-    }
+    return Response(_HEALTH_PREFIX + _iso_now().encode() + b'"}', media_type="application/json")
 
 if __name__ == "__main__":
     print("🚀 Starting RAG Chatbot Demo Server...")
-    print("📖 API Documentation: http://localhost:8001/docs")
-    print("🏠 Home: http://localhost:8001")
+    print(f"📖 API Documentation: http://localhost:{DEMO_PORT}/docs")
+    print(f"🏠 Home: http://localhost:{DEMO_PORT}")
     
+    # uvloop/httptools C fast paths; multiple workers need the app as an import string.
+    # Each worker keeps its own documents and caches. Multi-process alternative:
+    #   gunicorn -w $((2*$(nproc)+1)) -k uvicorn.workers.UvicornWorker -b 0.0.0.0:8001 working_demo_server:app
     uvicorn.run(
-        app,
-        host="0.0.0.0",
-        port=8001,
+        "working_demo_server:app",
+        host=DEMO_HOST,
+        port=DEMO_PORT,
+        loop="uvloop",
+        http="httptools",
+        workers=DEMO_WORKERS,
         log_level="info"
     ) 
\ No newline at end of file